@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+from . import cli
+from . import controllers
 from . import models
+from . import report
+from . import wizard
 from . import hooks
-from .hooks import post_init_migrate_from_studio
\ No newline at end of file
+from .hooks import post_init_migrate_from_studio, uninstall_drop_exposure_view
@@ -12,15 +12,25 @@
         "security/security.xml",
         "security/ir.model.access.csv",
         "data/sequence.xml",
-        "data/automation.xml",
+        "data/cron.xml",
         'views/sale_quotations_views.xml',
         'views/sale_quotations_action_menu.xml',
         "views/bonds_views.xml",
+        "views/bonds_credit_line_views.xml",
+        "wizard/bonds_import_wizard_views.xml",
+        "report/bonds_exposure_report_views.xml",
     ],
+    "assets": {
+        "web.assets_backend": [
+            "sid_bankbonds_mod/static/src/js/bond_pdf_viewer.js",
+        ],
+    },
     'installable' : True,
     'auto_install' : False,
     'application' : False,
 
     # Migración automática desde el modelo Studio (si existe): x_bonds.orders
     'post_init_hook': 'post_init_migrate_from_studio',
+    # La vista materializada del informe de exposición no la borra el ORM al desinstalar
+    'uninstall_hook': 'uninstall_drop_exposure_view',
 }
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Migración x_bonds.orders (Studio) -> sid_bonds_orders en paralelo, fuera de la instalación:
+
+    odoo-bin --addons-path=<rutas de addons> sid_migrate_studio -c odoo.conf -d <bd> --jobs 8
+
+Odoo solo busca comandos en los addons si --addons-path es el primer argumento.
+
+Reparte x_bonds_orders por rangos de id entre un pool de procesos; cada proceso abre su
+propio cursor y hace commit por lote/partición (con punto de control por partición, así
+que relanzar el comando continúa donde se quedó). Al final, en un solo proceso, se
+re-enlazan los Documents (carpeta AVALES) y se recalcula parent_path de los contratos.
+"""
+import argparse
+import logging
+import multiprocessing
+import time
+
+from psycopg2 import IntegrityError
+from psycopg2.extensions import TransactionRollbackError
+
+import odoo
+from odoo import SUPERUSER_ID, api
+from odoo.cli import Command
+from odoo.cli.command import commands
+from odoo.tools import config
+
+from ..hooks import (
+    STUDIO_MIGRATION_CHECKPOINT,
+    STUDIO_MIGRATION_CHUNK,
+    _finalize_studio_migration,
+    _migrate_studio_range,
+    _prepare_studio_migration,
+)
+
+_logger = logging.getLogger(__name__)
+
+# Reintentos de una partición ante conflictos de concurrencia, deadlocks o una referencia
+# duplicada insertada a la vez por otra partición (p.ej. dos procesos recalculando el mismo
+# contrato); el punto de control evita repetir lo ya hecho.
+_PARTITION_RETRIES = 5
+
+
+def _partition_checkpoint_key(id_from, id_to):
+    return "%s.%s_%s" % (STUDIO_MIGRATION_CHECKPOINT, id_from, id_to)
+
+
+def _clear_partition_checkpoints(env):
+    """
+    Borra los puntos de control de partición que queden (de una ejecución interrumpida,
+    quizá con otro --partition-size). Relanzar con otras particiones no los usa, pero
+    tampoco repite trabajo: _fetch_legacy_chunk solo devuelve lo que falta por migrar.
+    """
+    env.cr.execute(
+        "DELETE FROM ir_config_parameter WHERE key LIKE %s",
+        (STUDIO_MIGRATION_CHECKPOINT.replace("_", r"\_") + r".%",),
+    )
+    if env.cr.rowcount:
+        _logger.info("Removed %s stale partition checkpoints", env.cr.rowcount)
+
+
+def _compute_partitions(dbname, min_id, max_id, partition_size, chunk_size):
+    """Rangos (id_from, id_to] de ancho partition_size que cubren [min_id, max_id]."""
+    if min_id is None:
+        return []
+    step = max(partition_size, 1)
+    return [
+        (dbname, lo, min(lo + step, max_id), chunk_size)
+        for lo in range(min_id - 1, max_id, step)
+    ]
+
+
+def _run_partition(args):
+    """Migra el rango (id_from, id_to] en el proceso hijo. Devuelve (id_from, id_to, procesados)."""
+    dbname, id_from, id_to, chunk_size = args
+    registry = odoo.registry(dbname)
+    for attempt in range(1, _PARTITION_RETRIES + 1):
+        try:
+            with registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                processed = _migrate_studio_range(
+                    env, id_from, id_to,
+                    chunk_size=chunk_size,
+                    checkpoint_key=_partition_checkpoint_key(id_from, id_to),
+                    commit=True,
+                )
+            return id_from, id_to, processed
+        except (TransactionRollbackError, IntegrityError):
+            if attempt == _PARTITION_RETRIES:
+                raise
+            _logger.info("Partition (%s, %s] hit a concurrent update, retrying (%s)", id_from, id_to, attempt)
+            time.sleep(attempt)
+
+
+class SidMigrateStudio(Command):
+    """Migra x_bonds.orders (Studio) a sid_bonds_orders en paralelo por rangos de id"""
+
+    def run(self, args):
+        parser = argparse.ArgumentParser(
+            prog="%s %s" % (odoo.release.product_name.lower() + "-bin", self.name),
+            description=self.__doc__,
+        )
+        # No --workers: es una opción del servidor de Odoo y se confundiría con ella
+        parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(),
+                            help="Procesos en paralelo (por defecto, nº de CPUs)")
+        parser.add_argument("--partition-size", type=int, default=20000,
+                            help="Ancho del rango de ids por partición")
+        parser.add_argument("--chunk-size", type=int, default=STUDIO_MIGRATION_CHUNK,
+                            help="Registros por lote/commit dentro de cada partición")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Solo muestra las particiones, sin migrar ni modificar nada")
+        opts, odoo_args = parser.parse_known_args(args)
+
+        config.parse_config(odoo_args)
+        dbname = config["db_name"]
+        if not dbname or "," in dbname:
+            parser.error("Indica una única base de datos con -d/--database")
+
+        registry = odoo.registry(dbname)
+
+        # Fase 1 (un proceso): carpeta, artefactos Studio y particiones
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            if "x_bonds.orders" not in env or "sid_bonds_orders" not in env:
+                _logger.info("x_bonds.orders not found, nothing to migrate.")
+                return
+            cr.execute("SELECT MIN(id), MAX(id) FROM x_bonds_orders")
+            min_id, max_id = cr.fetchone()
+            partitions = _compute_partitions(dbname, min_id, max_id, opts.partition_size, opts.chunk_size)
+            if opts.dry_run:
+                for _dbname, id_from, id_to, _chunk_size in partitions:
+                    _logger.info("Partition (%s, %s]", id_from, id_to)
+                _logger.info("Dry run: %s partitions, %s jobs; nothing migrated.",
+                             len(partitions), max(1, min(opts.jobs, len(partitions) or 1)))
+                return
+            avales_folder = _prepare_studio_migration(env)
+            folder_id = avales_folder.id if avales_folder else False
+
+        if not partitions:
+            _logger.info("x_bonds_orders is empty, nothing to migrate.")
+
+        # Fase 2 (pool): los hijos no deben heredar conexiones abiertas del padre
+        if partitions:
+            odoo.sql_db.close_all()
+            jobs = max(1, min(opts.jobs, len(partitions)))
+            _logger.info("Migrating x_bonds_orders ids %s..%s in %s partitions with %s jobs",
+                         min_id, max_id, len(partitions), jobs)
+            total = 0
+            ctx = multiprocessing.get_context("fork")
+            with ctx.Pool(jobs) as pool:
+                for id_from, id_to, processed in pool.imap_unordered(_run_partition, partitions):
+                    total += processed
+                    _logger.info("Partition (%s, %s] done: %s records (total %s)",
+                                 id_from, id_to, processed, total)
+
+        # Fase 3 (un proceso): Documents y parent_path
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            avales_folder = env["documents.folder"].browse(folder_id) if folder_id else False
+            _finalize_studio_migration(env, avales_folder)
+            # Todo migrado: ningún punto de control de partición sigue siendo útil
+            _clear_partition_checkpoints(env)
+        _logger.info("sid_migrate_studio finished.")
+
+
+# En 15.0 CommandType registra el nombre de la clase en minúsculas (sidmigratestudio) e
+# ignora ``name``: se registra a mano con el nombre documentado
+commands.pop(SidMigrateStudio.name, None)
+SidMigrateStudio.name = "sid_migrate_studio"
+commands[SidMigrateStudio.name] = SidMigrateStudio
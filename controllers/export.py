@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import tempfile
+
+import xlsxwriter
+from werkzeug.exceptions import BadRequest, NotFound
+from werkzeug.wsgi import wrap_file
+
+from odoo import _, api, fields, http
+from odoo.http import content_disposition, request
+
+# Avales por página: una búsqueda ORM (reglas de acceso) + una consulta SQL por página
+EXPORT_PAGE_SIZE = 2000
+
+_EXPORT_QUERY = """
+    SELECT b.id, b.name, b.reference, p.name, j.name, cur.name, b.amount, b.base_pedidos,
+           b.issue_date, b.due_date, b.state, b.aval_type, b.origin_document,
+           (SELECT string_agg(q.name, ', ' ORDER BY q.name)
+              FROM sid_bonds_quotation_rel rel
+              JOIN sale_quotations q ON q.id = rel.quotation_id
+             WHERE rel.bond_id = b.id),
+           (SELECT string_agg(so.name, ', ' ORDER BY so.name)
+              FROM sid_bonds_quotation_rel rel
+              JOIN sale_order so ON so.quotations_id = rel.quotation_id
+                                 AND so.partner_id = b.partner_id
+             WHERE rel.bond_id = b.id AND so.state = 'sale')
+      FROM sid_bonds_orders b
+      LEFT JOIN res_partner p ON p.id = b.partner_id
+      LEFT JOIN account_journal j ON j.id = b.journal_id
+      LEFT JOIN res_currency cur ON cur.id = b.currency_id
+     WHERE b.id = ANY(%s)
+     ORDER BY b.id
+"""
+
+
+def _export_header(env):
+    Bond = env["sid_bonds_orders"]
+    names = ["id", "name", "reference", "partner_id", "journal_id", "currency_id", "amount",
+             "base_pedidos", "issue_date", "due_date", "state", "aval_type", "origin_document",
+             "contract_ids"]
+    return [Bond._fields[name]._description_string(env) for name in names] + [_("Pedidos confirmados")]
+
+
+def _iter_export_pages(env, domain, page_size=EXPORT_PAGE_SIZE):
+    """
+    Recorre los avales de domain por páginas (keyset sobre id, sin OFFSET) y devuelve
+    por página las filas ya resueltas: contratos y pedidos confirmados agregados en SQL.
+    Solo se mantiene en memoria una página.
+    """
+    Bond = env["sid_bonds_orders"]
+    state_labels = dict(Bond._fields["state"]._description_selection(env))
+    type_labels = dict(Bond._fields["aval_type"]._description_selection(env))
+    last_id = 0
+    while True:
+        # El ORM aplica reglas de registro; el detalle va por SQL
+        ids = Bond.search(domain + [("id", ">", last_id)], order="id", limit=page_size).ids
+        if not ids:
+            return
+        env.cr.execute(_EXPORT_QUERY, (ids,))
+        page = []
+        for row in env.cr.fetchall():
+            row = list(row)
+            row[10] = state_labels.get(row[10], row[10])
+            row[11] = type_labels.get(row[11], row[11] or "")
+            page.append(row)
+        yield page
+        last_id = ids[-1]
+        env["base"].invalidate_cache()
+
+
+class BondsExportController(http.Controller):
+
+    @http.route("/sid_bankbonds_mod/bonds/export", type="http", auth="user")
+    def bonds_export(self, format="csv", export_id=None, **kwargs):
+        """
+        Exportación de avales con contratos y pedidos confirmados, en streaming.
+        La selección llega por export_id (sid_bonds_export_request del usuario).
+        CSV: se escribe en la respuesta página a página (cursor propio, el de la petición
+        ya está cerrado cuando se consume). XLSX: xlsxwriter en modo constant_memory
+        sobre un fichero temporal que luego se sirve por trozos.
+        """
+        try:
+            export_request = request.env["sid_bonds_export_request"].browse(int(export_id)).exists()
+        except (TypeError, ValueError):
+            raise BadRequest("Invalid export")
+        if not export_request:
+            raise NotFound()
+        export_request.check_access_rule("read")
+        try:
+            domain = export_request._get_domain()
+        except ValueError:
+            raise BadRequest("Invalid domain")
+        if not isinstance(domain, list):
+            raise BadRequest("Invalid domain")
+        request.env["sid_bonds_orders"].check_access_rights("read")
+
+        filename = "avales_%s" % fields.Date.context_today(request.env.user)
+        if format == "xlsx":
+            return self._export_xlsx(domain, filename + ".xlsx")
+        if format != "csv":
+            raise BadRequest("Unsupported format")
+        return self._export_csv(domain, filename + ".csv")
+
+    def _export_csv(self, domain, filename):
+        registry = request.env.registry
+        uid = request.uid
+        context = dict(request.context)
+
+        def generate():
+            with registry.cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(_export_header(env))
+                for page in _iter_export_pages(env, domain):
+                    writer.writerows(page)
+                    yield buffer.getvalue().encode("utf-8")
+                    buffer.seek(0)
+                    buffer.truncate()
+                if buffer.tell():
+                    yield buffer.getvalue().encode("utf-8")
+
+        response = request.make_response(generate(), headers=[
+            ("Content-Type", "text/csv; charset=utf-8"),
+            ("Content-Disposition", content_disposition(filename)),
+        ])
+        response.direct_passthrough = True
+        return response
+
+    def _export_xlsx(self, domain, filename):
+        env = request.env
+        fileobj = tempfile.TemporaryFile()
+        workbook = xlsxwriter.Workbook(fileobj, {"constant_memory": True})
+        worksheet = workbook.add_worksheet(_("Avales"))
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+        worksheet.write_row(0, 0, _export_header(env), workbook.add_format({"bold": True}))
+        row_index = 1
+        for page in _iter_export_pages(env, domain):
+            for row in page:
+                for col, value in enumerate(row):
+                    if value is None:
+                        continue
+                    if col in (8, 9):
+                        worksheet.write_datetime(row_index, col, value, date_format)
+                    else:
+                        worksheet.write(row_index, col, value)
+                row_index += 1
+        workbook.close()
+        size = fileobj.tell()
+        fileobj.seek(0)
+
+        response = request.make_response(
+            wrap_file(request.httprequest.environ, fileobj),
+            headers=[
+                ("Content-Type", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+                ("Content-Disposition", content_disposition(filename)),
+                ("Content-Length", str(size)),
+            ],
+        )
+        response.direct_passthrough = True
+        return response
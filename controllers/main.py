@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import io
+
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, is_resource_modified
+from werkzeug.wsgi import wrap_file
+
+from odoo import http
+from odoo.http import content_disposition, request
+
+
+class BondsPdfController(http.Controller):
+
+    @http.route("/sid_bankbonds_mod/bond/<int:bond_id>/pdf", type="http", auth="user", methods=["GET", "HEAD"])
+    def bond_pdf(self, bond_id, download=False, **kwargs):
+        """
+        PDF del aval servido desde el filestore por trozos (sin cargarlo en memoria).
+        ETag = checksum del adjunto y Last-Modified = write_date, así que el visor solo
+        revalida (304) si el PDF no ha cambiado; admite peticiones Range (pdf.js las usa
+        para abrir PDFs grandes por partes).
+        """
+        bond = request.env["sid_bonds_orders"].browse(bond_id).exists()
+        if not bond:
+            raise NotFound()
+        bond.check_access_rights("read")
+        bond.check_access_rule("read")
+
+        attachment = request.env["ir.attachment"].sudo().search([
+            ("res_model", "=", bond._name),
+            ("res_field", "=", "pdf_aval"),
+            ("res_id", "=", bond.id),
+        ], limit=1)
+        if not attachment:
+            raise NotFound()
+
+        etag = attachment.checksum or str(attachment.id)
+        # Siempre revalidar: si el PDF se reemplaza cambia el ETag
+        cache_headers = [("Cache-Control", "private, max-age=0, must-revalidate")]
+
+        # 304 antes de abrir el fichero: una revalidación no toca el filestore
+        if not is_resource_modified(
+                request.httprequest.environ, etag=etag, last_modified=attachment.write_date):
+            response = request.make_response(b"", headers=cache_headers)
+            response.status_code = 304
+            response.set_etag(etag)
+            response.headers["Last-Modified"] = http_date(attachment.write_date)
+            return response
+
+        if attachment.store_fname:
+            fileobj = open(attachment._full_path(attachment.store_fname), "rb")
+        else:
+            fileobj = io.BytesIO(attachment.raw or b"")
+
+        filename = "%s.pdf" % bond._get_pdf_document_name()
+        response = request.make_response(
+            wrap_file(request.httprequest.environ, fileobj),
+            headers=[
+                ("Content-Type", "application/pdf"),
+                ("Content-Disposition", content_disposition(filename, "attachment" if download else "inline")),
+            ] + cache_headers,
+        )
+        response.direct_passthrough = True
+        response.set_etag(etag)
+        response.last_modified = attachment.write_date
+        # Aquí ya solo quedan Range/If-Range: 206 o 200 con el fichero abierto
+        return response.make_conditional(
+            request.httprequest, accept_ranges=True, complete_length=attachment.file_size,
+        )
@@ -1,126 +1,251 @@
 # -*- coding: utf-8 -*-
 import logging
+import os
+
+from psycopg2.extras import execute_values
 
 from odoo import api, SUPERUSER_ID
+from odoo.tools import config, str2bool
 
 _logger = logging.getLogger(__name__)
 
+# Tamaño de lote de la migración y clave del punto de control (último id legacy procesado)
+STUDIO_MIGRATION_CHUNK = 500
+STUDIO_MIGRATION_CHECKPOINT = "sid_bankbonds_mod.studio_migration_checkpoint"
+
+# Opción de odoo.conf / variable de entorno: la instalación no migra los avales (lo hará
+# el comando en paralelo sid_migrate_studio)
+STUDIO_MIGRATION_DEFER_OPTION = "sid_bankbonds_defer_studio_migration"
+
+_STATE_MAP = {
+    "draft": "draft",
+    "sent": "sent",
+    "pending_bank": "pending_bank",
+    "receipt": "receipt",
+    "solicit_dev": "solicit_dev",
+    "recovered": "recovered",
+    "solicit_can": "solicit_can",
+    "canceled": "cancelled",  # Studio usa 'canceled', nuevo usa 'cancelled'
+    "cancelled": "cancelled",
+}
+_AVAL_TYPE_MAP = {
+    "prov": "prov",
+    "adelanto": "adel",
+    "adel": "adel",
+    "fiel": "fiel",
+    "gar": "gar",
+    "fiel_gar": "fiel_gar",
+}
+
+
+def _load_legacy_map(env, mapping):
+    """
+    Carga {legacy_id: new_id} en la tabla temporal sid_legacy_bond_map (se borra al hacer
+    commit) para poder re-enlazar con un UPDATE ... FROM por tabla.
+    """
+    cr = env.cr
+    cr.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS sid_legacy_bond_map (
+            legacy_id INTEGER PRIMARY KEY,
+            new_id INTEGER NOT NULL
+        ) ON COMMIT DROP
+    """)
+    cr.execute("TRUNCATE sid_legacy_bond_map")
+    execute_values(
+        cr._obj,
+        "INSERT INTO sid_legacy_bond_map (legacy_id, new_id) VALUES %s",
+        list(mapping.items()),
+    )
+    cr.execute("ANALYZE sid_legacy_bond_map")
+
 
-def post_init_migrate_from_studio(cr, _registry):
+def _relink_legacy_records(env, mapping):
     """
-    Migración post-init:
-      - x_bonds.orders (Studio) -> sid_bonds_orders (módulo)
-      - Copia importes y moneda de forma fiable leyendo SQL (evita casos raros de ORM)
-      - Re-enlaza chatter/actividades/adjuntos
-      - Re-enlaza documents.document al nuevo modelo
-      - Asegura carpeta AVALES existente (reutiliza la actual si está) y crea xml_id estable
-        sid_bankbonds_mod.folder_avales para poder referenciarla sin depender de __export__.
+    Re-enlaza chatter, seguidores, actividades y adjuntos de x_bonds.orders a sid_bonds_orders:
+    un UPDATE por tabla contra la tabla temporal de mapeo, en lugar de un write() por fila.
+    Después se invalida la caché del ORM (los datos se han tocado por debajo).
     """
-    env = api.Environment(cr, SUPERUSER_ID, {})
+    if not mapping:
+        return
+    cr = env.cr
+    env["base"].flush()
+    _load_legacy_map(env, mapping)
+
+    cr.execute("""
+        UPDATE mail_message m
+           SET model = 'sid_bonds_orders', res_id = map.new_id
+          FROM sid_legacy_bond_map map
+         WHERE m.model = 'x_bonds.orders' AND m.res_id = map.legacy_id
+    """)
+    _logger.info("Relinked %s mail.message", cr.rowcount)
+
+    # Único (res_model, res_id, partner_id): si el partner ya sigue al aval nuevo
+    # (p.ej. el creador), se deja el seguidor antiguo donde estaba.
+    cr.execute("""
+        UPDATE mail_followers f
+           SET res_model = 'sid_bonds_orders', res_id = map.new_id
+          FROM sid_legacy_bond_map map
+         WHERE f.res_model = 'x_bonds.orders' AND f.res_id = map.legacy_id
+           AND NOT EXISTS (
+                SELECT 1 FROM mail_followers f2
+                 WHERE f2.res_model = 'sid_bonds_orders'
+                   AND f2.res_id = map.new_id
+                   AND f2.partner_id = f.partner_id
+           )
+    """)
+    _logger.info("Relinked %s mail.followers", cr.rowcount)
+
+    cr.execute("""
+        UPDATE mail_activity a
+           SET res_model = 'sid_bonds_orders', res_model_id = %s, res_id = map.new_id
+          FROM sid_legacy_bond_map map
+         WHERE a.res_model = 'x_bonds.orders' AND a.res_id = map.legacy_id
+    """, (env["ir.model"]._get_id("sid_bonds_orders"),))
+    _logger.info("Relinked %s mail.activity", cr.rowcount)
+
+    cr.execute("""
+        UPDATE ir_attachment att
+           SET res_model = 'sid_bonds_orders',
+               res_id = map.new_id,
+               res_field = CASE WHEN att.res_field = 'x_aval' THEN 'pdf_aval' ELSE att.res_field END
+          FROM sid_legacy_bond_map map
+         WHERE att.res_model = 'x_bonds.orders' AND att.res_id = map.legacy_id
+    """)
+    _logger.info("Relinked %s ir.attachment", cr.rowcount)
+
+    env["base"].invalidate_cache()
+
+
+def _relink_legacy_documents(env, avales_folder):
+    """
+    Re-enlaza documents.document (y su adjunto, como haría el inverse de res_model/res_id)
+    al nuevo modelo y los coloca en la carpeta AVALES, con UPDATE por lotes. El mapeo se
+    resuelve en SQL contra sid_bonds_orders.legacy_x_bonds_id (no hace falta tenerlo en memoria).
+    """
+    cr = env.cr
+    folder_id = avales_folder.id if avales_folder else None
+    env["base"].flush()
+
+    cr.execute("""
+        UPDATE documents_document d
+           SET res_model = 'sid_bonds_orders',
+               res_id = n.id,
+               folder_id = COALESCE(%s, d.folder_id)
+          FROM sid_bonds_orders n
+         WHERE d.res_model = 'x_bonds.orders' AND d.res_id = n.legacy_x_bonds_id
+    """, (folder_id,))
+    _logger.info("Relinked %s documents.document", cr.rowcount)
+
+    cr.execute("""
+        UPDATE ir_attachment att
+           SET res_model = d.res_model, res_id = d.res_id
+          FROM documents_document d
+         WHERE d.attachment_id = att.id
+           AND d.res_model = 'sid_bonds_orders'
+           AND att.res_model = 'x_bonds.orders'
+    """)
+
+    # Si hay docs sueltos basados en attachment que hemos re-enlazado, los metemos en AVALES.
+    if folder_id:
+        cr.execute("""
+            UPDATE documents_document
+               SET folder_id = %s
+             WHERE res_model = 'sid_bonds_orders' AND folder_id IS NULL
+        """, (folder_id,))
+
+    env["base"].invalidate_cache()
+
+
+# -------------------------------------------------------------------------
+# Helpers
+# -------------------------------------------------------------------------
+def _old_get(rec, *names, default=False):
+    """Lee campos de Studio/UI de forma tolerante a renombres o inexistencia."""
+    for n in names:
+        if n and n in rec._fields:
+            return rec[n]
+    return default
+
+
+def _ensure_xmlid(env, record, xmlid, *, noupdate=True):
+    """Asegura que exista un xml_id apuntando a record (lo crea o lo re-apunta)."""
+    if not record:
+        return False
+    module, name = xmlid.split(".", 1)
+    imd = env["ir.model.data"].sudo().search(
+        [("module", "=", module), ("name", "=", name)], limit=1
+    )
+    if imd:
+        if imd.model != record._name or imd.res_id != record.id:
+            # Re-apuntar para que el resto del módulo no dependa de __export__
+            imd.write({"model": record._name, "res_id": record.id, "noupdate": bool(noupdate)})
+        return xmlid
+    env["ir.model.data"].sudo().create(
+        {"module": module, "name": name, "model": record._name, "res_id": record.id, "noupdate": bool(noupdate)}
+    )
+    # Las búsquedas de xml_id del módulo están en ormcache (pudo guardarse "no existe")
+    env.registry.clear_caches()
+    return xmlid
 
-    # Modelos (si Studio no está instalado, no hacemos nada)
+
+def _ensure_avales_folder(env):
+    """
+    Reutiliza la carpeta AVALES ya existente o la crea si no existe.
+    Devuelve recordset documents.folder.
+    """
+    DF = env["documents.folder"].sudo()
+
+    folder = DF.search([("name", "=", "AVALES")], limit=1)
+
+    if not folder:
+        parent = DF.search([("parent_folder_id", "=", False), ("name", "ilike", "internal")], limit=1)
+        # fallback al folder interno estándar si existe
+        if env.ref("documents.documents_internal_folder", raise_if_not_found=False):
+            parent = env.ref("documents.documents_internal_folder").sudo()
+        vals = {"name": "AVALES", "parent_folder_id": parent.id if parent else False}
+        folder = DF.create(vals)
+        _logger.info("Created documents.folder AVALES id=%s", folder.id)
+    else:
+        _logger.info("Reusing documents.folder AVALES id=%s", folder.id)
+
+    # xmlid estable para el módulo
+    _ensure_xmlid(env, folder, "sid_bankbonds_mod.folder_avales", noupdate=True)
+
+    # Si existe regla/registro en sync.model (Cloud Sync) con doc_domain a una id distinta, la alineamos.
+    SM = env["sync.model"].sudo() if "sync.model" in env else None
+    if SM:
+        # en tu entorno la regla usa doc_domain de documents.document en contexto.
+        rules = SM.search([("name", "ilike", "AVALES")])
+        for r in rules:
+            if hasattr(r, "doc_domain") and r.doc_domain:
+                # patrón simple: [['id', '=', N]]
+                new_dom = "[['id', '=', %s]]" % folder.id
+                if r.doc_domain.strip() != new_dom:
+                    r.write({"doc_domain": new_dom})
+                    _logger.info("Updated sync.model(%s) doc_domain -> %s", r.id, new_dom)
+
+    return folder
+
+
+def _to_amount(value):
     try:
-        Old = env["x_bonds.orders"]
-        New = env["sid_bonds_orders"]
-    except KeyError:
-        return
+        return float(value or 0.0)
+    except Exception:
+        return 0.0
 
-    # ---------------------------------------------------------------------
-    # Helpers
-    # ---------------------------------------------------------------------
-    def _old_get(rec, *names, default=False):
-        """Lee campos de Studio/UI de forma tolerante a renombres o inexistencia."""
-        for n in names:
-            if n and n in rec._fields:
-                return rec[n]
-        return default
-
-    def _ensure_xmlid(record, xmlid, *, noupdate=True):
-        """Asegura que exista un xml_id apuntando a record (lo crea o lo re-apunta)."""
-        if not record:
-            return False
-        module, name = xmlid.split(".", 1)
-        imd = env["ir.model.data"].sudo().search(
-            [("module", "=", module), ("name", "=", name)], limit=1
-        )
-        if imd:
-            if imd.model != record._name or imd.res_id != record.id:
-                # Re-apuntar para que el resto del módulo no dependa de __export__
-                imd.write({"model": record._name, "res_id": record.id, "noupdate": bool(noupdate)})
-            return xmlid
-        env["ir.model.data"].sudo().create(
-            {"module": module, "name": name, "model": record._name, "res_id": record.id, "noupdate": bool(noupdate)}
-        )
-        return xmlid
 
-    def _ensure_avales_folder():
-        """
-        Reutiliza la carpeta AVALES ya existente o la crea si no existe.
-        Devuelve recordset documents.folder.
-        """
-        DF = env["documents.folder"].sudo()
-
-        folder = DF.search([("name", "=", "AVALES")], limit=1)
-
-        if not folder:
-            parent = DF.search([("parent_folder_id", "=", False), ("name", "ilike", "internal")], limit=1)
-            # fallback al folder interno estándar si existe
-            if env.ref("documents.documents_internal_folder", raise_if_not_found=False):
-                parent = env.ref("documents.documents_internal_folder").sudo()
-            vals = {"name": "AVALES", "parent_folder_id": parent.id if parent else False}
-            folder = DF.create(vals)
-            _logger.info("Created documents.folder AVALES id=%s", folder.id)
-        else:
-            _logger.info("Reusing documents.folder AVALES id=%s", folder.id)
-
-        # xmlid estable para el módulo
-        _ensure_xmlid(folder, "sid_bankbonds_mod.folder_avales", noupdate=True)
-
-        # Si existe regla/registro en sync.model (Cloud Sync) con doc_domain a una id distinta, la alineamos.
-        SM = env["sync.model"].sudo() if "sync.model" in env else None
-        if SM:
-            # en tu entorno la regla usa doc_domain de documents.document en contexto.
-            rules = SM.search([("name", "ilike", "AVALES")])
-            for r in rules:
-                if hasattr(r, "doc_domain") and r.doc_domain:
-                    # patrón simple: [['id', '=', N]]
-                    new_dom = "[['id', '=', %s]]" % folder.id
-                    if r.doc_domain.strip() != new_dom:
-                        r.write({"doc_domain": new_dom})
-                        _logger.info("Updated sync.model(%s) doc_domain -> %s", r.id, new_dom)
-
-        return folder
-
-    def _sql_old_amount_currency(old_id):
-        """
-        Devuelve (importe, currency_id) leyendo SQL directamente:
-        evita situaciones donde el ORM devuelve 0/False por causas laterales.
-        """
-        cr.execute(
-            "SELECT x_importe, x_currency_id FROM x_bonds_orders WHERE id = %s",
-            (old_id,),
-        )
-        row = cr.fetchone()
-        if not row:
-            return 0.0, False
-        amount = row[0] or 0.0
-        cur_id = row[1] or False
-        try:
-            amount = float(amount)
-        except Exception:
-            amount = 0.0
-        return amount, cur_id
-
-    # ---------------------------------------------------------------------
-    # Carpeta AVALES (reutilizar la actual, evitar duplicados)
-    # ---------------------------------------------------------------------
+# -------------------------------------------------------------------------
+# Fases de la migración (reutilizables desde el runner en paralelo)
+# -------------------------------------------------------------------------
+def _prepare_studio_migration(env):
+    """
+    Asegura la carpeta AVALES y desactiva los artefactos Studio para evitar coexistencia.
+    Devuelve la carpeta (o False si Documents no está instalado).
+    """
     avales_folder = False
     if "documents.folder" in env:
-        avales_folder = _ensure_avales_folder()
+        avales_folder = _ensure_avales_folder(env)
 
-    # ---------------------------------------------------------------------
-    # Desactivar artefactos Studio para evitar coexistencia
-    # ---------------------------------------------------------------------
     old_model_obj = env["ir.model"].sudo().search([("model", "=", "x_bonds.orders")], limit=1)
     if old_model_obj:
         env["ir.ui.view"].sudo().search([("model", "=", "x_bonds.orders"), ("active", "=", True)]).write({"active": False})
@@ -129,220 +254,253 @@ def post_init_migrate_from_studio(cr, _registry):
         if "base.automation" in env:
             env["base.automation"].sudo().search([("model_id", "=", old_model_obj.id)]).write({"active": False})
 
-    # ---------------------------------------------------------------------
-    # Mapas
-    # ---------------------------------------------------------------------
-    state_map = {
-        "draft": "draft",
-        "sent": "sent",
-        "pending_bank": "pending_bank",
-        "receipt": "receipt",
-        "solicit_dev": "solicit_dev",
-        "recovered": "recovered",
-        "solicit_can": "solicit_can",
-        "canceled": "cancelled",  # Studio usa 'canceled', nuevo usa 'cancelled'
-        "cancelled": "cancelled",
-    }
-    aval_type_map = {
-        "prov": "prov",
-        "adelanto": "adel",
-        "adel": "adel",
-        "fiel": "fiel",
-        "gar": "gar",
-        "fiel_gar": "fiel_gar",
-    }
-
-    # ---------------------------------------------------------------------
-    # Detectar migraciones previas e identificar registros a reparar
-    # ---------------------------------------------------------------------
-    legacy_rows = New.sudo().search_read(
-        [("legacy_x_bonds_id", "!=", False)],
-        ["id", "legacy_x_bonds_id", "amount", "currency_id"],
-    )
+    return avales_folder
 
-    legacy_to_new_id = {r["legacy_x_bonds_id"]: r["id"] for r in legacy_rows if r.get("legacy_x_bonds_id")}
-    existing_legacy_ids = set(legacy_to_new_id.keys())
-
-    # A reparar si amount=0/False o currency vacío.
-    bad_legacy_ids = {
-        r["legacy_x_bonds_id"]
-        for r in legacy_rows
-        if r.get("legacy_x_bonds_id")
-        and ((r.get("amount") in (0, 0.0, False, None)) or (not r.get("currency_id")))
-    }
-
-    # Olds a crear + olds a reparar
-    old_recs = Old.sudo().search([
-        "|",
-        ("id", "not in", list(existing_legacy_ids)),
-        ("id", "in", list(bad_legacy_ids)),
-    ])
-    if not old_recs:
-        _logger.info("No old records to migrate/repair.")
-        return
 
-    _logger.info("Migrating/repairing %s records from x_bonds.orders", len(old_recs))
-
-    legacy_to_new_created = {}  # ids creados en este post_init
-    batch = []
-    batch_old_ids = []
-
-    def _flush_batch():
-        nonlocal batch, batch_old_ids, legacy_to_new_created
-        if not batch:
-            return
-        new_recs = New.sudo().create(batch)
-        for o_id, n in zip(batch_old_ids, new_recs):
-            legacy_to_new_created[o_id] = n.id
-        batch = []
-        batch_old_ids = []
-
-    # ---------------------------------------------------------------------
-    # Loop
-    # ---------------------------------------------------------------------
-    for o in old_recs:
+def _fetch_legacy_chunk(env, after_id, until_id, limit):
+    """
+    Siguiente lote (paginación por id) de x_bonds_orders pendientes de migrar o reparar,
+    con importe y moneda leídos por SQL en la misma consulta.
+    Devuelve [(legacy_id, importe, currency_id, new_id o None)].
+    """
+    env.cr.execute("""
+        SELECT o.id, o.x_importe, o.x_currency_id, n.id
+          FROM x_bonds_orders o
+          LEFT JOIN sid_bonds_orders n ON n.legacy_x_bonds_id = o.id
+         WHERE o.id > %s
+           AND (%s IS NULL OR o.id <= %s)
+           AND (n.id IS NULL OR COALESCE(n.amount, 0) = 0 OR n.currency_id IS NULL)
+         ORDER BY o.id
+         LIMIT %s
+    """, (after_id, until_id, until_id, limit))
+    return env.cr.fetchall()
+
+
+def _legacy_reference_allocator(env, names):
+    """
+    reference es única (índice parcial): un x_name repetido en Studio (o ya usado en
+    sid_bonds_orders) se migra sin referencia (el nombre se conserva) en lugar de abortar
+    el lote. Devuelve free_reference(name, old_id) -> name o False; una consulta por lote.
+    """
+    used_references = set()
+    if names:
+        env.cr.execute(
+            "SELECT reference FROM sid_bonds_orders WHERE reference IN %s", (tuple(names),))
+        used_references = {row[0] for row in env.cr.fetchall()}
+
+    def free_reference(name, old_id):
+        if not name:
+            return False
+        if name in used_references:
+            _logger.warning("x_bonds.orders %s: duplicated reference %r, migrated without reference", old_id, name)
+            return False
+        used_references.add(name)
+        return name
+
+    return free_reference
+
+
+def _migrate_legacy_chunk(env, rows):
+    """
+    Crea o repara los sid_bonds_orders de un lote y re-enlaza chatter/actividades/adjuntos
+    de los creados. El PDF no se lee: el adjunto x_aval se re-asigna a pdf_aval por referencia.
+    """
+    Old = env["x_bonds.orders"].sudo()
+    # Datos históricos: el dispuesto de las líneas de avales se actualiza, sin bloquear por límite
+    New = env["sid_bonds_orders"].sudo().with_context(sid_bonds_skip_credit_check=True)
+    company_currency_id = env.company.currency_id.id
+
+    # Solo si x_aval vive en la propia tabla (no en ir.attachment) hay que copiar el contenido
+    aval_field = Old._fields.get("x_aval")
+    copy_aval = bool(aval_field) and not aval_field.attachment
+
+    olds = Old.browse([row[0] for row in rows])
+    old_by_id = {o.id: o for o in olds}
+
+    names = {name for name in olds.mapped(lambda o: _old_get(o, "x_name", default=False)) if name}
+    _free_reference = _legacy_reference_allocator(env, names)
+
+    vals_list = []
+    created_old_ids = []
+    for old_id, x_importe, x_currency_id, new_id in rows:
+        o = old_by_id[old_id]
         x_name = _old_get(o, "x_name", default=False)
-        x_cliente = _old_get(o, "x_cliente", default=False)
-        x_banco = _old_get(o, "x_banco", default=False)
-        x_create = _old_get(o, "x_create", default=False)
-        x_date = _old_get(o, "x_date", default=False)
-        x_modo = _old_get(o, "x_modo", default=False)
-        x_revisado = _old_get(o, "x_revisado", default=False)
-        x_estado = _old_get(o, "x_estado", default=False)
-        x_tipo = _old_get(o, "x_tipo", default=False)
-        x_aval = _old_get(o, "x_aval", default=False)
         x_pedidos = _old_get(o, "x_pedidos", default=False)
         x_contrato_recs = _old_get(o, "x_contrato", default=False)
         all_quotation_ids = set(x_pedidos.ids if x_pedidos else [])
         if x_contrato_recs:
             all_quotation_ids.update(x_contrato_recs.ids)
-
-        # Importes SIEMPRE por SQL
-        x_importe, x_currency_id = _sql_old_amount_currency(o.id)
+        amount = _to_amount(x_importe)
 
         # Reparación
-        if o.id in bad_legacy_ids and o.id in legacy_to_new_id:
-            new_rec = New.sudo().browse(legacy_to_new_id[o.id])
+        if new_id:
+            new_rec = New.browse(new_id)
             upd = {}
-
-            if (new_rec.amount in (0, 0.0, False, None)) and x_importe:
-                upd["amount"] = float(x_importe)
-
+            if (new_rec.amount in (0, 0.0, False, None)) and amount:
+                upd["amount"] = amount
             if not new_rec.currency_id:
-                if x_currency_id:
-                    upd["currency_id"] = int(x_currency_id)
-                else:
-                    upd["currency_id"] = env.company.currency_id.id
-
+                upd["currency_id"] = int(x_currency_id) if x_currency_id else company_currency_id
             if not new_rec.reference and x_name:
-                upd["reference"] = x_name
+                reference = _free_reference(x_name, o.id)
+                if reference:
+                    upd["reference"] = reference
             if not new_rec.name and x_name:
                 upd["name"] = x_name
             if all_quotation_ids:
                 upd["contract_ids"] = [(6, 0, list(all_quotation_ids))]
-
             if upd:
                 new_rec.write(upd)
             continue
 
         # Crear
+        x_cliente = _old_get(o, "x_cliente", default=False)
+        x_banco = _old_get(o, "x_banco", default=False)
         vals = {
             "legacy_x_bonds_id": o.id,
-            "reference": x_name or False,
+            "reference": _free_reference(x_name, o.id),
             "name": x_name or "AV-LEGACY-%s" % o.id,
             "partner_id": x_cliente.id if x_cliente else False,
             "journal_id": x_banco.id if x_banco else False,
-            "currency_id": int(x_currency_id) if x_currency_id else env.company.currency_id.id,
-            "amount": float(x_importe or 0.0),
-            "issue_date": x_create or False,
-            "due_date": x_date or False,
-            "is_digital": bool(x_modo),
-            "reviewed": bool(x_revisado),
-            "state": state_map.get(x_estado) or "draft",
-            "aval_type": aval_type_map.get(x_tipo) or False,
-            "pdf_aval": x_aval or False,
+            "currency_id": int(x_currency_id) if x_currency_id else company_currency_id,
+            "amount": amount,
+            "issue_date": _old_get(o, "x_create", default=False) or False,
+            "due_date": _old_get(o, "x_date", default=False) or False,
+            "is_digital": bool(_old_get(o, "x_modo", default=False)),
+            "reviewed": bool(_old_get(o, "x_revisado", default=False)),
+            "state": _STATE_MAP.get(_old_get(o, "x_estado", default=False)) or "draft",
+            "aval_type": _AVAL_TYPE_MAP.get(_old_get(o, "x_tipo", default=False)) or False,
             "contract_ids": [(6, 0, list(all_quotation_ids))],
         }
+        if copy_aval:
+            vals["pdf_aval"] = o.x_aval or False
+        vals_list.append(vals)
+        created_old_ids.append(o.id)
+
+    if vals_list:
+        new_recs = New.create(vals_list)
+        _relink_legacy_records(env, dict(zip(created_old_ids, new_recs.ids)))
+    return len(rows)
+
 
-        batch.append(vals)
-        batch_old_ids.append(o.id)
-
-        if len(batch) >= 200:
-            _flush_batch()
-
-    _flush_batch()
-
-    # ---------------------------------------------------------------------
-    # Re-enlazar chatter/actividades/adjuntos SOLO para los creados en este hook
-    # ---------------------------------------------------------------------
-    if legacy_to_new_created:
-        old_ids_created = list(legacy_to_new_created.keys())
-
-        msgs = env["mail.message"].sudo().search([
-            ("model", "=", "x_bonds.orders"),
-            ("res_id", "in", old_ids_created),
-        ])
-        for m in msgs:
-            new_id = legacy_to_new_created.get(m.res_id)
-            if new_id:
-                m.write({"model": "sid_bonds_orders", "res_id": new_id})
-
-        followers = env["mail.followers"].sudo().search([
-            ("res_model", "=", "x_bonds.orders"),
-            ("res_id", "in", old_ids_created),
-        ])
-        for f in followers:
-            new_id = legacy_to_new_created.get(f.res_id)
-            if new_id:
-                f.write({"res_model": "sid_bonds_orders", "res_id": new_id})
-
-        acts = env["mail.activity"].sudo().search([
-            ("res_model", "=", "x_bonds.orders"),
-            ("res_id", "in", old_ids_created),
-        ])
-        for a in acts:
-            new_id = legacy_to_new_created.get(a.res_id)
-            if new_id:
-                a.write({"res_model": "sid_bonds_orders", "res_id": new_id})
-
-        atts = env["ir.attachment"].sudo().search([
-            ("res_model", "=", "x_bonds.orders"),
-            ("res_id", "in", old_ids_created),
-        ])
-        for att in atts:
-            new_id = legacy_to_new_created.get(att.res_id)
-            if not new_id:
-                continue
-            vals = {"res_model": "sid_bonds_orders", "res_id": new_id}
-            if att.res_field == "x_aval":
-                vals["res_field"] = "pdf_aval"
-            att.write(vals)
-
-    # ---------------------------------------------------------------------
-    # Re-enlazar Documents (si el módulo Documents está instalado)
-    # ---------------------------------------------------------------------
-    if "documents.document" in env and legacy_to_new_id:
-        DD = env["documents.document"].sudo()
-
-        # Para todos (creados y ya existentes), re-enlazamos docs antiguos a nuevo modelo.
-        old_ids_all = list(legacy_to_new_id.keys())
-        docs = DD.search([("res_model", "=", "x_bonds.orders"), ("res_id", "in", old_ids_all)])
-        for d in docs:
-            new_id = legacy_to_new_id.get(d.res_id)
-            if not new_id:
-                continue
-            upd = {"res_model": "sid_bonds_orders", "res_id": new_id}
-            if avales_folder and d.folder_id.id != avales_folder.id:
-                upd["folder_id"] = avales_folder.id
-            d.write(upd)
-
-        # Si hay docs sueltos basados en attachment que hemos re-enlazado, los metemos en AVALES.
-        if avales_folder:
-            docs2 = DD.search([("res_model", "=", "sid_bonds_orders"), ("folder_id", "=", False)])
-            if docs2:
-                docs2.write({"folder_id": avales_folder.id})
+def _get_migration_checkpoint(env, checkpoint_key):
+    env.cr.execute("SELECT value FROM ir_config_parameter WHERE key = %s", (checkpoint_key,))
+    row = env.cr.fetchone()
+    return int(row[0]) if row and row[0] else 0
+
+
+def _set_migration_checkpoint(env, checkpoint_key, after_id):
+    """
+    Guarda (o borra, con after_id falsy) el punto de control con SQL directo: set_param
+    llama a clear_caches() y obligaría a todos los workers a vaciar su caché por lote.
+    """
+    if not after_id:
+        env.cr.execute("DELETE FROM ir_config_parameter WHERE key = %s", (checkpoint_key,))
+        return
+    env.cr.execute("""
+        INSERT INTO ir_config_parameter (key, value, create_uid, create_date, write_uid, write_date)
+        VALUES (%s, %s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC')
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, write_uid = EXCLUDED.write_uid,
+                                        write_date = EXCLUDED.write_date
+    """, (checkpoint_key, str(after_id), env.uid, env.uid))
+
+
+def _migrate_studio_range(env, id_from=0, id_to=None, chunk_size=STUDIO_MIGRATION_CHUNK,
+                          checkpoint_key=STUDIO_MIGRATION_CHECKPOINT, commit=False):
+    """
+    Migra/repara x_bonds_orders con id en (id_from, id_to] por lotes de chunk_size.
+
+    Tras cada lote se vacía la caché del ORM (la memoria no crece con la tabla). Con commit
+    (solo el comando sid_migrate_studio, nunca la instalación) se guarda además el último id
+    en ir_config_parameter (checkpoint_key) y se hace commit por lote, así una ejecución
+    interrumpida continúa donde se quedó. Al terminar se borra el punto de control para que
+    una ejecución posterior vuelva a revisar todo el rango.
+    Devuelve el número de registros procesados.
+    """
+    after_id = id_from or 0
+    if commit:
+        after_id = max(after_id, _get_migration_checkpoint(env, checkpoint_key))
+        if after_id > (id_from or 0):
+            _logger.info("Resuming Studio migration after x_bonds.orders id=%s", after_id)
+
+    processed = 0
+    while True:
+        rows = _fetch_legacy_chunk(env, after_id, id_to, chunk_size)
+        if not rows:
+            break
+        processed += _migrate_legacy_chunk(env, rows)
+        after_id = rows[-1][0]
+        env["base"].flush()
+        if commit:
+            _set_migration_checkpoint(env, checkpoint_key, after_id)
+            env.cr.commit()
+        env["base"].invalidate_cache()
+        _logger.info("Studio migration: %s records processed (last id=%s)", processed, after_id)
+
+    if commit:
+        _set_migration_checkpoint(env, checkpoint_key, False)
+        env.cr.commit()
+    return processed
+
+
+def _finalize_studio_migration(env, avales_folder):
+    """Re-enlaza Documents (creados ahora y ya existentes) y recalcula parent_path de contratos."""
+    if "documents.document" in env:
+        _relink_legacy_documents(env, avales_folder)
 
     if "sale.quotations" in env:
         env["sale.quotations"].sudo()._parent_store_compute()
 
+
+def _studio_migration_deferred():
+    """True si la migración de datos se deja para el comando sid_migrate_studio."""
+    value = os.environ.get(STUDIO_MIGRATION_DEFER_OPTION.upper()) or config.get(STUDIO_MIGRATION_DEFER_OPTION)
+    return str2bool(str(value), default=False) if value else False
+
+
+def post_init_migrate_from_studio(cr, _registry):
+    """
+    Migración post-init:
+      - x_bonds.orders (Studio) -> sid_bonds_orders (módulo), por lotes con punto de control
+      - Copia importes y moneda de forma fiable leyendo SQL (una consulta por lote)
+      - Re-enlaza chatter/actividades/adjuntos (UPDATE por tabla vía tabla temporal de mapeo);
+        el PDF x_aval pasa a pdf_aval re-asignando el adjunto, sin cargar su contenido
+      - Re-enlaza documents.document al nuevo modelo
+      - Asegura carpeta AVALES existente (reutiliza la actual si está) y crea xml_id estable
+        sid_bankbonds_mod.folder_avales para poder referenciarla sin depender de __export__.
+    Todo en la transacción de la instalación. Para tablas grandes: instalar con ``sid_bankbonds_defer_studio_migration = True`` en
+    odoo.conf (o la variable de entorno SID_BANKBONDS_DEFER_STUDIO_MIGRATION=1). La
+    instalación solo prepara la carpeta y desactiva Studio, y la migración se lanza después
+    con el comando en paralelo (cli/migrate_studio.py; --addons-path debe ir primero)::
+
+        odoo-bin --addons-path=... sid_migrate_studio -c odoo.conf -d <bd> --jobs 8
+    """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+
+    # Modelos (si Studio no está instalado, no hacemos nada)
+    if "x_bonds.orders" not in env or "sid_bonds_orders" not in env:
+        return
+
+    avales_folder = _prepare_studio_migration(env)
+
+    if _studio_migration_deferred():
+        _logger.info("Studio migration deferred: run 'odoo-bin --addons-path=... sid_migrate_studio "
+                     "-c <config> -d %s' to migrate x_bonds.orders.", cr.dbname)
+    else:
+        # Sin commit: la instalación sigue siendo una sola transacción (si algo falla
+        # después, no queda una migración a medias con el módulo sin instalar)
+        processed = _migrate_studio_range(env)
+        if not processed:
+            _logger.info("No old records to migrate/repair.")
+
+    _finalize_studio_migration(env, avales_folder)
+
     _logger.info("post_init_migrate_from_studio finished.")
+
+
+def uninstall_drop_exposure_view(cr, _registry):
+    """
+    ir.model._drop_table solo borra tablas y vistas normales: la vista materializada del
+    informe de exposición (sid_bonds_exposure_report) se borra aquí.
+    """
+    cr.execute("DROP MATERIALIZED VIEW IF EXISTS sid_bonds_exposure_report CASCADE")
+    _logger.info("Dropped materialized view sid_bonds_exposure_report.")
@@ -1,3 +1,9 @@
 # -*- coding: utf-8 -*-
 
-from . import bonds_order
\ No newline at end of file
+from . import bonds_order
+from . import bonds_credit_line
+from . import bonds_export
+from . import bonds_import
+from . import bonds_variation
+from . import res_users
+from . import sale_order
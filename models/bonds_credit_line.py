@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+
+class BondsCreditLine(models.Model):
+    """
+    Línea de avales concedida por un banco (diario) en una moneda.
+
+    utilized_amount es un contador (suma del importe de los avales vigentes del banco en
+    esa moneda) mantenido por diferencias desde sid_bonds_orders: comprobar el disponible
+    al activar o cambiar un importe no necesita agregar los avales.
+    """
+    _name = "sid_bonds_credit_line"
+    _description = "Línea de avales por banco"
+    _order = "journal_id, currency_id"
+    _rec_name = "journal_id"
+
+    journal_id = fields.Many2one(
+        "account.journal",
+        string="Banco",
+        required=True,
+        index=True,
+        domain=[("type", "=", "bank")],
+        ondelete="cascade",
+    )
+    company_id = fields.Many2one(related="journal_id.company_id", store=True)
+    currency_id = fields.Many2one(
+        "res.currency",
+        string="Moneda",
+        required=True,
+        default=lambda self: self.env.company.currency_id,
+    )
+    limit_amount = fields.Monetary(string="Límite", currency_field="currency_id", required=True)
+    utilized_amount = fields.Monetary(
+        string="Dispuesto",
+        currency_field="currency_id",
+        readonly=True,
+        copy=False,
+        help="Suma del importe de los avales vigentes de este banco en esta moneda.",
+    )
+    available_amount = fields.Monetary(
+        string="Disponible",
+        currency_field="currency_id",
+        compute="_compute_available_amount",
+    )
+    active = fields.Boolean(default=True)
+
+    _sql_constraints = [
+        ("journal_currency_uniq", "unique (journal_id, currency_id)",
+         "Solo puede haber una línea de avales por banco y moneda."),
+    ]
+
+    @api.depends("limit_amount", "utilized_amount")
+    def _compute_available_amount(self):
+        for line in self:
+            line.available_amount = line.limit_amount - line.utilized_amount
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines._recompute_utilization()
+        return lines
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {"journal_id", "currency_id", "active"}.intersection(vals):
+            self._recompute_utilization()
+        return res
+
+    def _recompute_utilization(self):
+        """Recalcula el dispuesto desde los avales (alta de línea o acción de administración)."""
+        if not self:
+            return
+        self.flush(["journal_id", "currency_id"])
+        self.env["sid_bonds_orders"].flush(["state", "amount", "journal_id", "currency_id"])
+        self.env.cr.execute("""
+            SELECT id FROM sid_bonds_credit_line WHERE id IN %s ORDER BY id FOR UPDATE
+        """, (tuple(self.ids),))
+        self.env.cr.execute("""
+            UPDATE sid_bonds_credit_line l
+               SET utilized_amount = COALESCE((
+                    SELECT SUM(b.amount)
+                      FROM sid_bonds_orders b
+                     WHERE b.state = 'active'
+                       AND b.journal_id = l.journal_id
+                       AND b.currency_id = l.currency_id
+               ), 0)
+             WHERE l.id IN %s
+        """, (tuple(self.ids),))
+        self.invalidate_cache(["utilized_amount"], self.ids)
+
+    def action_recompute_utilization(self):
+        self._recompute_utilization()
+
+    @api.model
+    def _apply_utilization_deltas(self, deltas, check=True):
+        """
+        deltas: {(journal_id, currency_id): importe}. Bloquea las líneas afectadas (FOR UPDATE,
+        en orden de id para no cruzar bloqueos entre usuarios), comprueba el disponible de las
+        que aumentan y actualiza el contador en un único UPDATE.
+        Si otra transacción ha modificado la línea entretanto, PostgreSQL aborta esta con un
+        error de serialización y Odoo reintenta la petición con el valor ya actualizado.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if key[0] and key[1] and delta}
+        if not deltas:
+            return
+        journal_ids, currency_ids = zip(*deltas)
+        cr = self.env.cr
+        cr.execute("""
+            SELECT l.id, l.journal_id, l.currency_id, l.limit_amount, l.utilized_amount
+              FROM sid_bonds_credit_line l
+              JOIN unnest(%s::int[], %s::int[]) AS k(journal_id, currency_id)
+                ON k.journal_id = l.journal_id AND k.currency_id = l.currency_id
+             WHERE l.active
+             ORDER BY l.id
+               FOR UPDATE OF l
+        """, (list(journal_ids), list(currency_ids)))
+        rows = cr.fetchall()
+        if not rows:
+            return
+
+        errors = []
+        updates = []
+        for line_id, journal_id, currency_id, limit_amount, utilized in rows:
+            delta = deltas[(journal_id, currency_id)]
+            new_utilized = (utilized or 0.0) + delta
+            currency = self.env["res.currency"].browse(currency_id)
+            if check and delta > 0 and currency.compare_amounts(new_utilized, limit_amount or 0.0) > 0:
+                journal = self.env["account.journal"].browse(journal_id)
+                errors.append(_("%(bank)s: límite %(limit)s, dispuesto %(used)s, se necesitan %(delta)s más.") % {
+                    "bank": journal.display_name,
+                    "limit": limit_amount,
+                    "used": utilized or 0.0,
+                    "delta": delta,
+                })
+            updates.append((line_id, delta))
+        if errors:
+            raise UserError(_("Se supera la línea de avales del banco:\n%s") % "\n".join(errors))
+
+        line_ids, amounts = zip(*updates)
+        cr.execute("""
+            UPDATE sid_bonds_credit_line l
+               SET utilized_amount = COALESCE(l.utilized_amount, 0) + d.delta
+              FROM unnest(%s::int[], %s::numeric[]) AS d(id, delta)
+             WHERE l.id = d.id
+        """, (list(line_ids), list(amounts)))
+        self.invalidate_cache(["utilized_amount"], list(line_ids))
+
+
+class BondsOrderCreditLine(models.Model):
+    """Mantenimiento del dispuesto de las líneas de avales al crear/modificar avales."""
+    _inherit = "sid_bonds_orders"
+
+    _CREDIT_LINE_TRIGGERS = {"state", "amount", "journal_id", "currency_id"}
+
+    def _credit_line_contributions(self):
+        """{(journal_id, currency_id): importe} de los avales vigentes del recordset."""
+        contributions = defaultdict(float)
+        for bond in self:
+            if bond.state == "active" and bond.journal_id:
+                contributions[(bond.journal_id.id, bond.currency_id.id)] += bond.amount or 0.0
+        return contributions
+
+    def _update_credit_lines(self, before, after):
+        deltas = defaultdict(float)
+        for key, amount in before.items():
+            deltas[key] -= amount
+        for key, amount in after.items():
+            deltas[key] += amount
+        self.env["sid_bonds_credit_line"].sudo()._apply_utilization_deltas(
+            deltas, check=not self.env.context.get("sid_bonds_skip_credit_check"))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        after = records._credit_line_contributions()
+        if after:
+            records._update_credit_lines({}, after)
+        return records
+
+    def write(self, vals):
+        if not self._CREDIT_LINE_TRIGGERS.intersection(vals):
+            return super().write(vals)
+        before = self._credit_line_contributions()
+        res = super().write(vals)
+        self._update_credit_lines(before, self._credit_line_contributions())
+        return res
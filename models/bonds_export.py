@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import json
+
+from odoo import fields, models
+
+
+class BondsExportRequest(models.TransientModel):
+    """
+    Selección de una exportación en streaming guardada en servidor: la URL del controlador
+    solo lleva el id de este registro, nunca la lista de ids (sin límite de tamaño).
+    """
+    _name = "sid_bonds_export_request"
+    _description = "Selección de exportación de avales"
+
+    domain = fields.Text(string="Dominio", required=True, default="[]")
+
+    def _get_domain(self):
+        self.ensure_one()
+        return json.loads(self.domain)
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+import base64
+import logging
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import float_compare
+
+_logger = logging.getLogger(__name__)
+
+_TRUE_VALUES = {"1", "true", "yes", "y", "si", "sí", "x"}
+
+
+class BondsOrderImport(models.Model):
+    """Importación/actualización masiva de avales (listados del banco) por referencia."""
+    _inherit = "sid_bonds_orders"
+
+    # Columnas admitidas en CSV/JSON -> campo del aval
+    _IMPORT_SIMPLE_FIELDS = {
+        "amount": "amount",
+        "issue_date": "issue_date",
+        "due_date": "due_date",
+        "is_digital": "is_digital",
+        "reviewed": "reviewed",
+        "state": "state",
+        "aval_type": "aval_type",
+        "description": "description",
+        "pdf": "pdf_aval",
+    }
+
+    def init(self):
+        super().init()
+        # Clave del upsert: referencia única (si ya hay duplicados no se puede crear el índice)
+        cr = self._cr
+        cr.execute("""
+            SELECT reference FROM sid_bonds_orders
+             WHERE reference IS NOT NULL AND reference <> ''
+             GROUP BY reference HAVING COUNT(*) > 1
+             LIMIT 5
+        """)
+        duplicates = [row[0] for row in cr.fetchall()]
+        if duplicates:
+            _logger.warning(
+                "sid_bonds_orders: duplicated references (%s...), unique index on reference not created; "
+                "bulk import will still upsert by reference but cannot rely on the index.",
+                ", ".join(duplicates),
+            )
+            return
+        cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS sid_bonds_orders_reference_uniq
+                ON sid_bonds_orders (reference)
+             WHERE reference IS NOT NULL AND reference <> ''
+        """)
+
+    def _check_reference_available(self, references):
+        """
+        Mensaje legible antes que el error del índice único: se comprueba antes del INSERT/
+        UPDATE (después, la transacción ya estaría abortada). Una consulta para el lote.
+        """
+        references = [ref for ref in references if ref]
+        duplicated = {ref for ref in references if references.count(ref) > 1}
+        if references:
+            duplicated.update(self.search([
+                ("reference", "in", references), ("id", "not in", self.ids),
+            ]).mapped("reference"))
+        if duplicated:
+            raise ValidationError(
+                _("Ya existe un aval con la referencia: %s") % ", ".join(sorted(duplicated)))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.browse()._check_reference_available([vals.get("reference") for vals in vals_list])
+        return super().create(vals_list)
+
+    def write(self, vals):
+        if vals.get("reference"):
+            # Varios avales con la misma referencia nueva también chocarían entre sí
+            self._check_reference_available([vals["reference"]] * len(self))
+        return super().write(vals)
+
+    # ---------------------------------------------------------------------
+    # Resolución por conjuntos (una búsqueda por modelo para todo el fichero)
+    # ---------------------------------------------------------------------
+    @api.model
+    def _import_partner_map(self, keys):
+        """
+        {clave: partner_id} buscando por NIF, referencia interna o nombre exacto (ambiguo -> False).
+        El NIF es un campo comercial (los contactos heredan el de su empresa): por NIF solo
+        cuenta la entidad comercial, no sus contactos.
+        """
+        if not keys:
+            return {}
+        keys = list(keys)
+        partners = self.env["res.partner"].search_read(
+            ["|", "|", ("vat", "in", keys), ("ref", "in", keys), ("name", "in", keys)],
+            ["vat", "ref", "name", "commercial_partner_id"],
+        )
+        result = {}
+        for field_name in ("name", "ref", "vat"):  # el último gana: NIF > ref > nombre
+            matches = {}
+            for partner in partners:
+                if partner[field_name]:
+                    partner_id = partner["id"]
+                    if field_name == "vat":
+                        partner_id = partner["commercial_partner_id"][0]
+                    matches.setdefault(partner[field_name], set()).add(partner_id)
+            for key, ids in matches.items():
+                result[key] = ids.pop() if len(ids) == 1 else False
+        return result
+
+    @api.model
+    def _import_journal_map(self, keys):
+        if not keys:
+            return {}
+        keys = list(keys)
+        journals = self.env["account.journal"].search_read(
+            [("type", "=", "bank"), "|", ("code", "in", keys), ("name", "in", keys)],
+            ["code", "name"],
+        )
+        result = {}
+        for journal in journals:
+            result.setdefault(journal["name"], journal["id"])
+            result[journal["code"]] = journal["id"]
+        return result
+
+    @api.model
+    def _import_currency_map(self, keys):
+        if not keys:
+            return {}
+        currencies = self.env["res.currency"].with_context(active_test=False).search_read(
+            [("name", "in", [key.upper() for key in keys])], ["name"],
+        )
+        return {currency["name"]: currency["id"] for currency in currencies}
+
+    @api.model
+    def _import_contract_map(self, keys):
+        if not keys:
+            return {}
+        contracts = self.env["sale.quotations"].search_read([("name", "in", list(keys))], ["name"])
+        return {contract["name"]: contract["id"] for contract in contracts}
+
+    # ---------------------------------------------------------------------
+    # Conversión de valores
+    # ---------------------------------------------------------------------
+    @api.model
+    def _import_selection_value(self, field_name, value):
+        value = str(value).strip()
+        for key, label in self._fields[field_name].selection:
+            if value == key or value.lower() == label.lower():
+                return key
+        raise ValueError(_("Valor no válido para %s: %s") % (field_name, value))
+
+    @api.model
+    def _import_convert(self, field_name, value):
+        field = self._fields[field_name]
+        if field.type == "boolean":
+            return value if isinstance(value, bool) else str(value).strip().lower() in _TRUE_VALUES
+        if value in (None, ""):
+            return False
+        if field.type in ("float", "monetary"):
+            return float(value) if isinstance(value, (int, float)) else float(str(value).replace(",", "."))
+        if field.type == "date":
+            return fields.Date.to_date(value)
+        if field.type == "selection":
+            return self._import_selection_value(field_name, value)
+        return value
+
+    @staticmethod
+    def _import_split(value):
+        if not value:
+            return []
+        if isinstance(value, (list, tuple)):
+            return [str(item).strip() for item in value if str(item).strip()]
+        return [item.strip() for item in str(value).replace(";", ",").split(",") if item.strip()]
+
+    @api.model
+    def _import_binary_checksum(self, value):
+        """Checksum (el de ir.attachment) del contenido base64 importado."""
+        if not value:
+            return False
+        return self.env["ir.attachment"]._compute_checksum(base64.b64decode(value))
+
+    def _import_stored_checksums(self, field_name):
+        """{bond_id: checksum} del adjunto del campo binario (una búsqueda para el lote)."""
+        attachments = self.env["ir.attachment"].sudo().search_read([
+            ("res_model", "=", self._name),
+            ("res_field", "=", field_name),
+            ("res_id", "in", self.ids),
+        ], ["res_id", "checksum"])
+        return {att["res_id"]: att["checksum"] for att in attachments}
+
+    def _import_changed_vals(self, vals, checksums=None):
+        """
+        Solo los valores que cambian respecto al aval (evita writes y tracking inútiles).
+        Los binarios se comparan por checksum con ``checksums`` ({campo: {bond_id: checksum}}),
+        sin leer el contenido del adjunto.
+        """
+        self.ensure_one()
+        changed = {}
+        for field_name, value in vals.items():
+            field = self._fields[field_name]
+            if field.type == "binary":
+                current = (checksums or {}).get(field_name, {}).get(self.id, False)
+                same = self._import_binary_checksum(value) == current
+                if not same:
+                    changed[field_name] = value
+                continue
+            current = self[field_name]
+            if field.type == "many2one":
+                same = current.id == (value or False)
+            elif field.type == "many2many":
+                same = set(current.ids) == set(value[0][2])
+            elif field.type in ("float", "monetary"):
+                same = float_compare(current or 0.0, value or 0.0, precision_digits=6) == 0
+            else:
+                same = (current or False) == (value or False)
+            if not same:
+                changed[field_name] = value
+        return changed
+
+    def _import_apply_safe(self, apply, errors):
+        """
+        apply(avales) en un savepoint. Si falla con UserError (p.ej. se supera la línea de
+        avales del banco), se repite aval a aval, cada uno en su savepoint, y el mensaje de
+        los que fallan queda en errors ({bond_id: mensaje}): una fila no anula el fichero.
+        Devuelve los avales aplicados.
+        """
+        try:
+            with self.env.cr.savepoint():
+                apply(self)
+            return self
+        except UserError:
+            # Lo escrito en caché (o pendiente de volcar) dentro del savepoint ya no vale
+            self.env.clear()
+        done = self.browse()
+        for bond in self:
+            try:
+                with self.env.cr.savepoint():
+                    apply(bond)
+            except UserError as e:
+                self.env.clear()
+                errors[bond.id] = str(e)
+            else:
+                done |= bond
+        return done
+
+    def _import_apply_states(self, state_by_bond):
+        """
+        Aplica el estado importado ({bond_id: estado}) con las mismas reglas que los botones
+        (_STATE_TRANSITIONS): un aval no se pone Vigente con importe 0 por importarlo.
+        Los estados sin transición definida se escriben tal cual. Un write por estado destino.
+        Devuelve (avales cambiados, {bond_id: mensaje} de los que no se pueden cambiar).
+        """
+        transition_by_state = {
+            transition["to"]: name for name, transition in self._STATE_TRANSITIONS.items()}
+        by_state = {}
+        for bond in self.browse(list(state_by_bond)):
+            if bond.state != state_by_bond[bond.id]:
+                by_state.setdefault(state_by_bond[bond.id], self.browse())
+                by_state[state_by_bond[bond.id]] |= bond
+
+        changed = self.browse()
+        errors = {}
+        for state, bonds in by_state.items():
+            name = transition_by_state.get(state)
+            if not name:
+                changed |= bonds._import_apply_safe(lambda recs: recs.write({"state": state}), errors)
+                continue
+            valid = bonds.browse()
+            for bond in bonds:
+                try:
+                    bond._check_state_transition(name)
+                except UserError as e:
+                    errors[bond.id] = str(e)
+                else:
+                    valid |= bond
+            # La transición también puede fallar al escribir (línea de avales del banco)
+            changed |= valid._import_apply_safe(lambda recs: recs._apply_state_transition(name), errors)
+        return changed, errors
+
+    # ---------------------------------------------------------------------
+    # Importación
+    # ---------------------------------------------------------------------
+    @api.model
+    def import_bonds(self, rows, batch_size=500):
+        """
+        Crea o actualiza avales a partir de filas (dicts de CSV/JSON) usando ``reference``
+        como clave.
+
+        Columnas: reference (obligatoria), partner (NIF, ref. o nombre), journal (código o
+        nombre del diario de banco), currency (código ISO), contracts (nombres separados por
+        coma o lista), amount, issue_date, due_date, is_digital, reviewed, state, aval_type,
+        description y pdf (base64).
+
+        Partners, diarios, monedas, contratos y avales existentes se resuelven con una
+        búsqueda por modelo; se escribe por lotes y los avisos de variación y la
+        sincronización con Documents se hacen una sola vez al final. El estado pasa por las
+        reglas de _STATE_TRANSITIONS (si no se puede aplicar, la fila se informa como error
+        y el resto de valores se guardan) y el PDF solo se reescribe si cambia su checksum.
+        Lo que rechaza el write (p.ej. superar la línea de avales del banco) se informa por
+        fila, sin deshacer el resto del fichero.
+        Devuelve {"created": n, "updated": n, "unchanged": n, "errors": [(fila, mensaje)]}.
+        """
+        errors = []
+        rows = [
+            {str(key).strip().lower(): value for key, value in row.items() if key}
+            for row in rows
+        ]
+
+        partner_keys, journal_keys, currency_keys, contract_keys = set(), set(), set(), set()
+        for row in rows:
+            if row.get("partner"):
+                partner_keys.add(str(row["partner"]).strip())
+            if row.get("journal"):
+                journal_keys.add(str(row["journal"]).strip())
+            if row.get("currency"):
+                currency_keys.add(str(row["currency"]).strip())
+            contract_keys.update(self._import_split(row.get("contracts")))
+
+        partner_map = self._import_partner_map(partner_keys)
+        journal_map = self._import_journal_map(journal_keys)
+        currency_map = self._import_currency_map(currency_keys)
+        contract_map = self._import_contract_map(contract_keys)
+
+        vals_by_reference = {}
+        line_by_reference = {}
+        for line, row in enumerate(rows, start=1):
+            reference = str(row.get("reference") or "").strip()
+            if not reference:
+                errors.append((line, _("Falta la referencia")))
+                continue
+            try:
+                vals = {"reference": reference}
+                for column, field_name in self._IMPORT_SIMPLE_FIELDS.items():
+                    if column in row:
+                        vals[field_name] = self._import_convert(field_name, row[column])
+                if row.get("partner"):
+                    vals["partner_id"] = partner_map.get(str(row["partner"]).strip())
+                    if not vals["partner_id"]:
+                        raise ValueError(_("Cliente no encontrado o ambiguo: %s") % row["partner"])
+                if row.get("journal"):
+                    vals["journal_id"] = journal_map.get(str(row["journal"]).strip())
+                    if not vals["journal_id"]:
+                        raise ValueError(_("Banco no encontrado: %s") % row["journal"])
+                if row.get("currency"):
+                    vals["currency_id"] = currency_map.get(str(row["currency"]).strip().upper())
+                    if not vals["currency_id"]:
+                        raise ValueError(_("Moneda no encontrada: %s") % row["currency"])
+                if "contracts" in row:
+                    names = self._import_split(row["contracts"])
+                    missing = [name for name in names if name not in contract_map]
+                    if missing:
+                        raise ValueError(_("Contratos no encontrados: %s") % ", ".join(missing))
+                    vals["contract_ids"] = [(6, 0, [contract_map[name] for name in names])]
+            except ValueError as e:
+                errors.append((line, str(e)))
+                continue
+            # La misma referencia repetida en el fichero: gana la última fila
+            vals_by_reference[reference] = vals
+            line_by_reference[reference] = line
+
+        # El estado se aplica al final, con las reglas de _STATE_TRANSITIONS
+        state_by_reference = {
+            reference: vals.pop("state") for reference, vals in vals_by_reference.items()
+            if vals.get("state")
+        }
+
+        Bonds = self.with_context(
+            sid_bonds_skip_variation_note=True,
+            sid_bonds_skip_pdf_sync=True,
+            mail_create_nolog=True,
+        )
+        existing = Bonds.search([("reference", "in", list(vals_by_reference))])
+        existing_by_reference = {bond.reference: bond for bond in existing}
+        old_map = existing._read_stored_base_pedidos()
+        checksums = {"pdf_aval": existing._import_stored_checksums("pdf_aval")}
+
+        # Altas por lotes
+        to_create = [vals for reference, vals in vals_by_reference.items()
+                     if reference not in existing_by_reference]
+        created = Bonds.browse()
+        for start in range(0, len(to_create), batch_size):
+            created |= Bonds.create(to_create[start:start + batch_size])
+
+        # Modificaciones: solo lo que cambia, un write por grupo de valores iguales. El PDF
+        # (distinto por aval) se escribe aparte y solo si cambia su checksum.
+        groups = {}
+        pdf_changed = []
+        for reference, bond in existing_by_reference.items():
+            changed = bond._import_changed_vals(vals_by_reference[reference], checksums)
+            if "pdf_aval" in changed:
+                pdf_changed.append((bond.id, changed.pop("pdf_aval")))
+            if changed:
+                key = tuple(sorted((name, repr(value)) for name, value in changed.items()))
+                groups.setdefault(key, (changed, []))[1].append(bond.id)
+        updated_ids = set()
+        write_errors = {}
+        for changed, bond_ids in groups.values():
+            for start in range(0, len(bond_ids), batch_size):
+                written = Bonds.browse(bond_ids[start:start + batch_size])._import_apply_safe(
+                    lambda recs: recs.write(changed), write_errors)
+                updated_ids.update(written.ids)
+        for bond in self.browse(list(write_errors)):
+            errors.append((line_by_reference[bond.reference],
+                           _("Valores no aplicados: %s") % write_errors[bond.id]))
+        for bond_id, pdf in pdf_changed:
+            Bonds.browse(bond_id).write({"pdf_aval": pdf})
+        updated_ids.update(bond_id for bond_id, _pdf in pdf_changed)
+
+        bond_by_reference = {**existing_by_reference, **{bond.reference: bond for bond in created}}
+        state_changed, state_errors = Bonds._import_apply_states({
+            bond_by_reference[reference].id: state for reference, state in state_by_reference.items()})
+        updated_ids.update(state_changed.ids)
+        for bond in self.browse(list(state_errors)):
+            errors.append((line_by_reference[bond.reference],
+                           _("Estado no aplicado: %s") % state_errors[bond.id]))
+
+        # Lo diferido: avisos de variación y Documents, una vez para todo el fichero
+        updated = self.browse(updated_ids) - created
+        if updated:
+            updated._post_base_pedidos_variation_note(old_map)
+        pdf_ids = {bond_id for bond_id, _pdf in pdf_changed}
+        with_pdf = created.filtered(
+            lambda bond: vals_by_reference[bond.reference].get("pdf_aval")) | self.browse(pdf_ids)
+        with_pdf.with_context(sid_bonds_skip_pdf_sync=False)._sync_pdf_documents()
+
+        _logger.info("Bond import: %s created, %s updated, %s errors",
+                     len(created), len(updated), len(errors))
+        return {
+            "created": len(created),
+            "updated": len(updated),
+            "unchanged": len(existing) - len(updated),
+            "errors": errors,
+        }
@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
+import threading
+from datetime import timedelta
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import UserError, ValidationError
+from odoo.osv import expression
+from odoo.tools.translate import _lt
+from werkzeug.urls import url_encode
 
 _logger = logging.getLogger(__name__)
 
@@ -15,6 +21,9 @@ class BondsOrder ( models.Model ) :
     _BOND_STATES_SKIP_NOTIFY = {"expired", "solicit_dev", "recovered",
                                 "solicit_can", "cancelled"}
 
+    # Campos cuyo write puede cambiar base_pedidos (o la escribe) y dispara el aviso de variación
+    _BASE_PEDIDOS_TRIGGERS = {"contract_ids", "base_pedidos", "partner_id"}
+
     name = fields.Char (
         string="Referencia",
         default=lambda self : _ ( "New" ),
@@ -22,7 +31,8 @@ class BondsOrder ( models.Model ) :
         store=True,
         tracking=True,
     )
-    reference = fields.Char ( string="Referencia (externa)" )
+    # Única (índice sid_bonds_orders_reference_uniq): no se copia al duplicar
+    reference = fields.Char ( string="Referencia (externa)", copy=False )
 
     partner_id = fields.Many2one ( "res.partner", string="Cliente",
                                    tracking=True, store=True )
@@ -81,6 +91,21 @@ class BondsOrder ( models.Model ) :
         help="Porcentaje mínimo de variación en Base Imponible Pedidos para publicar aviso y crear actividad.",
     )
 
+    expiry_reminder_sent = fields.Boolean(
+        string="Aviso de vencimiento enviado",
+        readonly=True,
+        copy=False,
+        help="Se reinicia al cambiar la fecha de vencimiento.",
+    )
+
+    base_pedidos_dirty = fields.Boolean(
+        string="Base pendiente de recalcular",
+        index=True,
+        readonly=True,
+        copy=False,
+        help="Marcado en modo diferido cuando cambian pedidos del aval; lo procesa el cron.",
+    )
+
     legacy_x_bonds_id = fields.Integer(
         string="Legacy x_bonds.orders ID",
         index=True,
@@ -159,98 +184,190 @@ class BondsOrder ( models.Model ) :
                 bond.state_manage = "new"
 
     def write(self, vals) :
-        # 1) Guardamos el valor anterior (calculado) antes del write
-        # OJO: base_pedidos es compute store=True; leemos el valor actual antes del write.
-        old_map = {b.id : b.base_pedidos for b in self}
+        # 1) Guardamos el valor anterior solo si el write puede cambiar la base:
+        # editar campos no relacionados (reviewed, description...) no paga el agregado.
+        notify = bool ( self._BASE_PEDIDOS_TRIGGERS.intersection ( vals ) ) and not self.env.context.get (
+            "sid_bonds_skip_variation_note" )
+        old_map = self._read_stored_base_pedidos () if notify else {}
 
         # 2) write normal (y lógica de name/reference)
         if "reference" in vals and vals.get ( "reference" ) :
             vals = dict ( vals )
             vals["name"] = vals["reference"]
 
+        # Nueva fecha de vencimiento: el aviso "próximo a vencer" vuelve a estar pendiente
+        if "due_date" in vals and "expiry_reminder_sent" not in vals :
+            vals = dict ( vals, expiry_reminder_sent=False )
+
+        # PDF vaciado: el documento de AVALES se conserva con su propia copia
+        if "pdf_aval" in vals and not vals["pdf_aval"] :
+            self._detach_pdf_documents ()
+
         res = super ().write ( vals )
 
+        # PDF o referencia nuevos: documento en AVALES (sin re-escribir el binario)
+        if self._PDF_DOCUMENT_TRIGGERS.intersection ( vals ) :
+            self._sync_pdf_documents ()
+
         # 3) Si el write afecta a algo que pueda cambiar la base, evaluamos después
         # Esto evita spam si editas campos no relacionados.
-        triggers = {"contract_ids", "base_pedidos",
-                    "partner_id"}  # si quieres, añade aquí otras cosas
-        if triggers.intersection ( vals.keys () ) :
+        if notify :
             self._post_base_pedidos_variation_note ( old_map )
 
         return res
 
+    def _read_stored_base_pedidos(self) :
+        """
+        {bond_id: base_pedidos} leído de la columna en una consulta.
+        Antes se vuelcan (y recalculan si están pendientes) los valores de estos avales,
+        de modo que el resultado es el mismo que leer bond.base_pedidos.
+        """
+        ids = [bond_id for bond_id in self.ids if isinstance ( bond_id, int )]
+        if not ids :
+            return {}
+        self.flush ( ["base_pedidos"], self.browse ( ids ) )
+        self.env.cr.execute (
+            "SELECT id, base_pedidos FROM sid_bonds_orders WHERE id IN %s",
+            (tuple ( ids ),),
+        )
+        return {bond_id : value or 0.0 for bond_id, value in self.env.cr.fetchall ()}
+
     def _schedule_creator_todo(self, old_value, new_value, pct) :
         """
         Activity tipo 'Por hacer' para create_uid (si existe).
         Evita duplicados abiertos con el mismo resumen.
         """
         self.ensure_one ()
-        if not self.create_uid :
-            return
+        self._schedule_creator_todos ( {self.id : (old_value, new_value, pct)} )
 
-        # tipo de actividad 'Por hacer' estándar
-        todo_type = self.env.ref ( "mail.mail_activity_data_todo",
-                                   raise_if_not_found=False )
-        if not todo_type :
-            return
+    def _schedule_creator_todos(self, variations) :
+        """
+        Versión por lotes de _schedule_creator_todo.
+        variations: {bond_id: (old_value, new_value, pct)}
+        """
+        summary = _ ( "Revisar necesidad de ampliar aval" )
+        todo_vals = {}
+        for bond in self :
+            if not bond.create_uid or bond.id not in variations :
+                continue
+            old_value, new_value, pct = variations[bond.id]
 
-        # Umbral por aval (default 3.0 si vacío)
-        thr = float ( getattr ( self, "variation_threshold_pct", 3.0 ) or 0.0 )
+            # Umbral por aval (default 3.0 si vacío)
+            thr = float ( bond.variation_threshold_pct or 0.0 )
 
-        summary = _ ( "Revisar necesidad de ampliar aval" )
+            note = _ (
+                "Se detectó variación >= %(thr).2f%% en Base Imponible Pedidos.\n"
+                "Anterior: %(old).2f\n"
+                "Nuevo: %(new).2f\n"
+                "Cambio: %(pct).2f%%\n\n"
+                "Revisar si es necesario ampliar el aval o avales asociados."
+            ) % {
+                       "thr" : thr,
+                       "old" : old_value,
+                       "new" : new_value,
+                       "pct" : pct,
+                   }
+            todo_vals[bond.id] = (bond.create_uid.id, note)
 
-        note = _ (
-            "Se detectó variación >= %(thr).2f%% en Base Imponible Pedidos.\n"
-            "Anterior: %(old).2f\n"
-            "Nuevo: %(new).2f\n"
-            "Cambio: %(pct).2f%%\n\n"
-            "Revisar si es necesario ampliar el aval o avales asociados."
-        ) % {
-                   "thr" : thr,
-                   "old" : old_value,
-                   "new" : new_value,
-                   "pct" : pct,
-               }
+        self._create_todo_activities ( summary, todo_vals )
+
+    def _create_todo_activities(self, summary, todo_vals, deadlines=None) :
+        """
+        Crea actividades 'Por hacer' en bloque.
+        todo_vals: {bond_id: (user_id, note)}
+        deadlines: {bond_id: fecha límite} opcional (por defecto hoy)
+        Omite los avales que ya tienen una actividad abierta con el mismo resumen y usuario:
+        la comprobación es un único read_group y la creación un único create(vals_list).
+        """
+        if not todo_vals :
+            return self.env["mail.activity"]
+
+        # tipo de actividad 'Por hacer' estándar
+        todo_type_id = self._get_cached_ref_id ( "mail.mail_activity_data_todo" )
+        if not todo_type_id :
+            return self.env["mail.activity"]
 
         # Evita spam: buscamos actividades pendientes por fecha límite (Odoo 15 no tiene date_done)
-        existing = self.env["mail.activity"].search ( [
+        groups = self.env["mail.activity"].read_group ( [
             ("res_model", "=", self._name),
-            ("res_id", "=", self.id),
-            ("user_id", "=", self.create_uid.id),
-            ("activity_type_id", "=", todo_type.id),
+            ("res_id", "in", list ( todo_vals )),
+            ("activity_type_id", "=", todo_type_id),
             ("summary", "=", summary),
             ("date_deadline", "!=", False),
-        ], limit=1 )
-        if existing :
-            return
+        ], ["res_id", "user_id"], ["res_id", "user_id"], lazy=False )
+        existing = {
+            (group["res_id"], group["user_id"][0])
+            for group in groups if group["user_id"]
+        }
 
         deadline = fields.Date.context_today ( self )  # hoy
-        self.activity_schedule (
-            activity_type_id=todo_type.id,
-            user_id=self.create_uid.id,
-            summary=summary,
-            note=note,
-            date_deadline=deadline,
-        )
+        res_model_id = self.env["ir.model"]._get_id ( self._name )
+        vals_list = [
+            {
+                "res_model_id" : res_model_id,
+                "res_id" : bond_id,
+                "activity_type_id" : todo_type_id,
+                "user_id" : user_id,
+                "summary" : summary,
+                "note" : note,
+                "date_deadline" : (deadlines or {}).get ( bond_id ) or deadline,
+                "automated" : True,
+            }
+            for bond_id, (user_id, note) in todo_vals.items ()
+            if (bond_id, user_id) not in existing
+        ]
+        return self.env["mail.activity"].create ( vals_list )
 
     def _get_bonds_manager_partners(self) :
         """Devuelve res.partner (partners) de usuarios del grupo de Gestión de Avales."""
-        group = self.env.ref (
-            "sid_bankbonds_mod.group_bonds_manager",
-            raise_if_not_found=False )
-        if not group :
-            return self.env["res.partner"]
-        users = group.users
-        return users.mapped ( "partner_id" )
+        return self.env["res.partner"].browse ( self._get_bonds_manager_partner_ids () )
+
+    # ------------------------------------------------------------------
+    # Cachés de registry (ormcache) para el camino caliente de write().
+    # Se invalidan con clear_caches(): Odoo lo hace al tocar ir.model.data y
+    # res.groups; el resto de casos los cubre models/res_users.py.
+    # ------------------------------------------------------------------
+    @api.model
+    @tools.ormcache ( "xmlid" )
+    def _get_cached_ref_id(self, xmlid) :
+        """id del registro referenciado por xmlid, o False si no existe."""
+        record = self.env.ref ( xmlid, raise_if_not_found=False )
+        return record.id if record else False
+
+    @api.model
+    @tools.ormcache ()
+    def _get_bonds_manager_partner_ids(self) :
+        group_id = self._get_cached_ref_id ( "sid_bankbonds_mod.group_bonds_manager" )
+        if not group_id :
+            return ()
+        users = self.env["res.groups"].sudo ().browse ( group_id ).users
+        return tuple ( users.mapped ( "partner_id" ).ids )
+
+    @api.model
+    @tools.ormcache ()
+    def _get_bonds_manager_mentions_html(self) :
+        """Fragmento HTML con las menciones a los gestores (vacío si no hay)."""
+        partners = self._get_bonds_manager_partners ().sudo ()
+        return " ".join (
+            f'<a data-oe-model="res.partner" data-oe-id="{p.id}">@{p.display_name}</a>'
+            for p in partners
+        )
 
     def _post_base_pedidos_variation_note(self, old_map) :
         """
         old_map: {bond_id: old_base_pedidos}
         Si variación > umbral y estado permitido:
           - publica nota interna mencionando a usuarios del grupo (si hay)
+          - encola la variación para el resumen a gestores (sid_bonds_variation)
           - crea activity tipo Por hacer para create_uid
+        Las notas (_message_log_batch) y la cola se crean en bloque, no una a una.
         """
-        partners = self._get_bonds_manager_partners ()
+        # menciones HTML (solo si hay gestores): iguales para todos los avales
+        mentions_html = self._get_bonds_manager_mentions_html ()
+
+        bodies = {}
+        variation_vals_list = []
+        todos = {}
 
         for bond in self :
             # 1) estados excluidos
@@ -277,14 +394,6 @@ class BondsOrder ( models.Model ) :
             if not changed :
                 continue
 
-            # 3) menciones HTML (solo si hay partners)
-            mentions_html = ""
-            if partners :
-                mentions_html = " ".join (
-                    f'<a data-oe-model="res.partner" data-oe-id="{p.id}">@{p.display_name}</a>'
-                    for p in partners
-                )
-
             body = _ (
                 "<p><b>Variación en Base Imponible Pedidos</b> (&gt; %(thr).2f%%)</p>"
                 "<p>Anterior: %(old)s<br/>Nuevo: %(new)s<br/>Cambio: %(pct).2f%%</p>"
@@ -297,24 +406,28 @@ class BondsOrder ( models.Model ) :
                        "mentions" : f"<p>{mentions_html}</p>" if mentions_html else "",
                    }
 
-            # 4) Si hay partners, notificar; si no, postear nota sin notify (evita warning)
-            bond.message_post (
-                body=body,
-                message_type="comment",
-                subtype_xmlid="mail.mt_note",
-            )
+            # 3) Nota interna en el chatter (sin notificación: la cubre el resumen)
+            bodies[bond.id] = body
 
-            # 4b) Notificación solo si hay destinatarios
-            if partners :
-                bond.message_notify (
-                    body=body,
-                    message_type="comment",
-                    subtype_xmlid="mail.mt_note",
-                    partner_ids=partners.ids,
-                )
+            # 4) Cola para el resumen a gestores
+            variation_vals_list.append ( {
+                "bond_id" : bond.id,
+                "old_value" : old,
+                "new_value" : new,
+                "pct" : pct,
+                "threshold" : threshold,
+            } )
+
+            todos[bond.id] = (old, new, pct)
 
-            # 5) Activity al creador
-            bond._schedule_creator_todo ( old, new, pct )
+        if bodies :
+            # Subtipo por defecto: mail.mt_note
+            self.browse ( list ( bodies ) )._message_log_batch ( bodies=bodies, message_type="comment" )
+        if variation_vals_list :
+            self.env["sid_bonds_variation"].sudo ().create ( variation_vals_list )
+
+        # 5) Activity al creador
+        self._schedule_creator_todos ( todos )
 
     def action_view_sale_orders(self) :
         bonds = self.filtered ( lambda b : b.contract_ids )
@@ -331,15 +444,13 @@ class BondsOrder ( models.Model ) :
         return action
 
     # Con esta computación podemos tener el amount_untaxed de los pedidos confirmados que estén relacionados con el valor de quotations_id
-    @api.depends (
-        "contract_ids",
-        "partner_id",
-        "contract_ids.sale_order_ids.amount_untaxed",
-        "contract_ids.sale_order_ids.state",
-        "contract_ids.sale_order_ids.partner_id",
-    )
+    # Los cambios en los pedidos (importe, estado, cliente, contrato) NO pasan por este depends:
+    # sale.order aplica el delta sobre los avales afectados (ver _apply_base_pedidos_delta).
+    @api.depends ( "contract_ids", "partner_id" )
     def _compute_base_pedidos(self) :
-        for bond in self :
+        # Registros en memoria (onchange / NewId): no están en BD, cálculo en Python
+        new_bonds = self.filtered ( lambda b : isinstance ( b.id, models.NewId ) )
+        for bond in new_bonds :
             if not bond.contract_ids or not bond.partner_id :
                 # compute store: asignación directa (NO write dentro del compute)
                 bond.base_pedidos = 0.0
@@ -351,6 +462,217 @@ class BondsOrder ( models.Model ) :
             )
             bond.base_pedidos = sum ( orders.mapped ( "amount_untaxed" ) )
 
+        # Registros guardados: una única consulta agregada para todo el lote
+        bonds = self - new_bonds
+        totals = bonds._read_base_pedidos_totals ()
+        for bond in bonds :
+            bond.base_pedidos = totals.get ( bond.id, 0.0 )
+
+    def _read_base_pedidos_totals(self):
+        """
+        Devuelve {bond_id: suma amount_untaxed} de los pedidos confirmados (state='sale')
+        de los contratos del aval cuyo cliente coincide con el del aval.
+
+        Una sola consulta agrupada sobre sid_bonds_quotation_rel ⋈ sale_order para todo
+        el recordset. El cliente del aval se toma de la caché (puede no estar aún en BD),
+        por eso se pasa como parámetro en lugar de unir con sid_bonds_orders.
+        Los avales sin cliente o sin contratos no aparecen en el resultado (base 0).
+        """
+        pairs = [(bond.id, bond.partner_id.id) for bond in self if bond.partner_id]
+        if not pairs:
+            return {}
+
+        # Los valores pendientes de los pedidos deben estar en BD antes de agregar
+        self.env["sale.order"].flush(["quotations_id", "partner_id", "state", "amount_untaxed"])
+
+        bond_ids, partner_ids = zip(*pairs)
+        self.env.cr.execute(
+            """
+            SELECT b.bond_id, SUM(so.amount_untaxed)
+              FROM unnest(%s::int[], %s::int[]) AS b(bond_id, partner_id)
+              JOIN sid_bonds_quotation_rel rel ON rel.bond_id = b.bond_id
+              JOIN sale_order so ON so.quotations_id = rel.quotation_id
+                                 AND so.partner_id = b.partner_id
+             WHERE so.state = 'sale'
+             GROUP BY b.bond_id
+            """,
+            (list(bond_ids), list(partner_ids)),
+        )
+        return {bond_id: total or 0.0 for bond_id, total in self.env.cr.fetchall()}
+
+    @api.model
+    def _get_base_pedidos_mode(self):
+        """
+        Modo de mantenimiento de base_pedidos ante cambios en sale.order:
+          - delta: aplica solo la diferencia de los pedidos modificados (por defecto)
+          - full: recálculo completo (SQL) de los avales afectados
+          - deferred: marca los avales afectados y los recalcula el cron en lotes
+        """
+        mode = self.env["ir.config_parameter"].sudo().get_param(
+            "sid_bankbonds_mod.base_pedidos_mode", "delta")
+        if self.env.context.get("sid_bonds_full_recompute"):
+            mode = "full"
+        return mode if mode in ("delta", "full", "deferred") else "delta"
+
+    def _apply_base_pedidos_delta(self, deltas):
+        """
+        deltas: {bond_id: diferencia de base_pedidos} calculada por sale.order.
+        Se escribe vía ORM (sudo: el usuario de ventas no tiene por qué poder escribir avales)
+        para conservar tracking y el aviso de variación de write().
+        """
+        bonds = self.sudo().exists()
+        if not bonds:
+            return
+        mode = self._get_base_pedidos_mode()
+        if mode == "deferred":
+            bonds._mark_base_pedidos_dirty()
+            return
+        if mode == "full":
+            bonds._recompute_base_pedidos_full()
+            return
+
+        changed = bonds.filtered(
+            lambda b: not (b.currency_id or b.env.company.currency_id).is_zero(deltas.get(b.id, 0.0)))
+        if changed:
+            # Un solo aviso de variación para todo el lote (no uno por write)
+            old_map = changed._read_stored_base_pedidos()
+            for bond in changed.with_context(sid_bonds_skip_variation_note=True):
+                bond.write({"base_pedidos": bond.base_pedidos + deltas[bond.id]})
+            changed._post_base_pedidos_variation_note(old_map)
+        # Los nombres de pedidos confirmados también alimentan el documento de origen
+        self.env.add_to_compute(self._fields["origin_document"], bonds)
+
+    def _recompute_base_pedidos_full(self):
+        """Recalcula base_pedidos desde cero (una consulta) y escribe solo lo que cambia."""
+        totals = self._read_base_pedidos_totals()
+        changed = self.filtered(
+            lambda b: (b.currency_id or b.env.company.currency_id).compare_amounts(
+                totals.get(b.id, 0.0), b.base_pedidos) != 0)
+        if changed:
+            old_map = changed._read_stored_base_pedidos()
+            for bond in changed.with_context(sid_bonds_skip_variation_note=True):
+                bond.write({"base_pedidos": totals.get(bond.id, 0.0)})
+            changed._post_base_pedidos_variation_note(old_map)
+        self.env.add_to_compute(self._fields["origin_document"], self)
+
+    def _mark_base_pedidos_dirty(self):
+        """
+        Modo diferido: marca los avales por SQL (sin tracking ni avisos) y despierta al cron.
+        Sin filtro "AND NOT base_pedidos_dirty": el UPDATE debe bloquear la fila aunque ya
+        esté marcada, para no perder la marca si el cron la está limpiando a la vez.
+        """
+        if not self:
+            return
+        self.env.cr.execute(
+            "UPDATE sid_bonds_orders SET base_pedidos_dirty = TRUE WHERE id IN %s",
+            (tuple(self.ids),),
+        )
+        self.invalidate_cache(["base_pedidos_dirty"], self.ids)
+        cron = self.env.ref("sid_bankbonds_mod.ir_cron_sid_bonds_process_dirty", raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _cron_process_dirty_bonds(self, batch_size=500):
+        """
+        Drena un lote de avales marcados: recálculo completo (SQL), documento de origen y
+        evaluación del umbral de variación. Si quedan más, se vuelve a disparar el cron.
+        """
+        # Bloqueo de las filas del lote: un marcado concurrente espera a nuestro commit
+        self.env.cr.execute(
+            """
+            SELECT id FROM sid_bonds_orders
+             WHERE base_pedidos_dirty
+             ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+            """,
+            (batch_size,),
+        )
+        bonds = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if not bonds:
+            return
+
+        old_map = {bond.id: bond.base_pedidos for bond in bonds}
+        totals = bonds._read_base_pedidos_totals()
+        silent = bonds.with_context(sid_bonds_skip_variation_note=True)
+        for bond in silent:
+            new = totals.get(bond.id, 0.0)
+            currency = bond.currency_id or bond.env.company.currency_id
+            if currency.compare_amounts(new, bond.base_pedidos) != 0:
+                bond.write({"base_pedidos": new})
+        silent.write({"base_pedidos_dirty": False})
+        self.env.add_to_compute(self._fields["origin_document"], bonds)
+        bonds._post_base_pedidos_variation_note(old_map)
+        bonds.flush()
+
+        if not getattr(threading.current_thread(), "testing", False):
+            self.env.cr.commit()
+        if self.search_count([("base_pedidos_dirty", "=", True)]):
+            self.env.ref("sid_bankbonds_mod.ir_cron_sid_bonds_process_dirty")._trigger()
+
+    def init(self):
+        # Vencimientos y avisos filtran siempre por estado + fecha de vencimiento
+        tools.create_index(
+            self._cr, "sid_bonds_orders_state_due_date_idx", self._table, ["state", "due_date"])
+
+    @api.model
+    def _cron_expire_due_bonds(self, batch_size=1000):
+        """
+        Vence los avales vigentes con fecha de vencimiento pasada y programa los avisos
+        de "próximo a vencer". Cada ejecución solo lee los avales que cambian (índice
+        state + due_date); si el lote se llena, se vuelve a disparar el cron.
+        """
+        today = fields.Date.context_today(self)
+        due = self.search(
+            [("state", "=", "active"), ("due_date", "<", today)],
+            order="due_date, id",
+            limit=batch_size,
+        )
+        if due:
+            due._apply_state_transition("expire")
+            _logger.info("Avales vencidos por cron: %s", len(due))
+
+        reminded = self._schedule_expiry_reminders(today, batch_size)
+
+        if len(due) == batch_size or len(reminded) == batch_size:
+            self.env.ref("sid_bankbonds_mod.ir_cron_sid_bonds_expire")._trigger()
+
+    @api.model
+    def _schedule_expiry_reminders(self, today, batch_size):
+        """Actividad 'Aval próximo a vencer' (en bloque) para los que vencen en N días."""
+        days = int(self.env["ir.config_parameter"].sudo().get_param(
+            "sid_bankbonds_mod.expiry_reminder_days", 30))
+        bonds = self.search(
+            [
+                ("state", "=", "active"),
+                ("due_date", ">=", today),
+                ("due_date", "<=", today + timedelta(days=days)),
+                ("expiry_reminder_sent", "=", False),
+            ],
+            order="due_date, id",
+            limit=batch_size,
+        )
+        if not bonds:
+            return bonds
+
+        summary = _("Aval próximo a vencer")
+        todo_vals = {}
+        for bond in bonds.filtered("create_uid"):
+            note = _("El aval %(bond)s vence el %(date)s. Revisar renovación o devolución.") % {
+                "bond": bond.display_name,
+                "date": bond.due_date,
+            }
+            todo_vals[bond.id] = (bond.create_uid.id, note)
+        bonds._create_todo_activities(summary, todo_vals, {bond.id: bond.due_date for bond in bonds})
+        bonds.write({"expiry_reminder_sent": True})
+        return bonds
+
+    def action_recompute_base_pedidos(self):
+        """Fallback manual: recálculo completo de la base de los avales seleccionados."""
+        self._recompute_base_pedidos_full()
+        return True
+
     @api.depends ( "contract_ids", "partner_id" )
     def _compute_documento_origen(self) :
         records_with_data = self.filtered ( lambda r : r.contract_ids and r.partner_id )
@@ -382,45 +704,287 @@ class BondsOrder ( models.Model ) :
             unique_names = list ( dict.fromkeys ( names ) )
             record.origin_document = ", ".join ( unique_names ) or False
 
+    # ------------------------------------------------------------------
+    # Transiciones de estado: tabla declarativa + validación y write por lote
+    #   to:    estado destino
+    #   from:  estados de origen permitidos (None = cualquiera)
+    #   skip:  estados que se ignoran sin error
+    #   check: método que valida el lote y devuelve mensajes de error
+    # ------------------------------------------------------------------
+    _STATE_TRANSITIONS = {
+        "request" : {
+            "to" : "requested",
+            "from" : ("draft",),
+            "error" : _lt ( "Solo puedes solicitar desde Borrador." ),
+        },
+        "activate" : {
+            "to" : "active",
+            "from" : ("requested", "draft"),
+            "error" : _lt ( "Solo puedes poner Vigente desde Solicitado o Borrador." ),
+            "check" : "_check_transition_positive_amount",
+        },
+        "expire" : {
+            "to" : "expired",
+            "from" : ("active",),
+            "error" : _lt ( "Solo puedes vencer un aval vigente." ),
+        },
+        "cancel" : {
+            "to" : "cancelled",
+            "skip" : ("expired", "cancelled"),
+        },
+        "set_draft" : {
+            "to" : "draft",
+        },
+    }
+
+    def _check_transition_positive_amount(self) :
+        wrong = self.filtered ( lambda b : not b.amount or b.amount <= 0 )
+        if not wrong :
+            return []
+        return ["%s\n%s" % (_ ( "El importe debe ser positivo." ),
+                             ", ".join ( wrong.mapped ( "display_name" ) ))]
+
+    def _check_state_transition(self, transition_name) :
+        """
+        Valida la transición sobre todo el recordset y lanza UserError con todos los
+        avales erróneos a la vez. Devuelve los avales a los que aplica (sin los "skip").
+        """
+        transition = self._STATE_TRANSITIONS[transition_name]
+        bonds = self.filtered ( lambda b : b.state not in transition.get ( "skip", () ) )
+
+        errors = []
+        allowed = transition.get ( "from" )
+        if allowed :
+            wrong = bonds.filtered ( lambda b : b.state not in allowed )
+            if wrong :
+                errors.append ( "%s\n%s" % (transition["error"],
+                                             ", ".join ( wrong.mapped ( "display_name" ) )) )
+        if transition.get ( "check" ) :
+            errors.extend ( getattr ( bonds, transition["check"] ) () )
+        if errors :
+            raise UserError ( "\n\n".join ( errors ) )
+        return bonds
+
+    def _apply_state_transition(self, transition_name) :
+        """
+        Valida la transición (_check_state_transition) y aplica un único write por
+        estado destino.
+        """
+        transition = self._STATE_TRANSITIONS[transition_name]
+        bonds = self._check_state_transition ( transition_name )
+        bonds = bonds.filtered ( lambda b : b.state != transition["to"] )
+        if bonds :
+            bonds.write ( {"state" : transition["to"]} )
+        return bonds
+
     def action_request(self) :
-        for rec in self :
-            if rec.state != "draft" :
-                raise UserError (
-                    _ ( "Solo puedes solicitar desde Borrador." ) )
-            rec.state = "requested"
+        self._apply_state_transition ( "request" )
 
     def action_activate(self) :
-        for rec in self :
-            if rec.state not in ("requested", "draft") :
-                raise UserError (
-                    _ ( "Solo puedes poner Vigente desde Solicitado o Borrador." ) )
-            if not rec.amount or rec.amount <= 0 :
-                raise UserError ( _ ( "El importe debe ser positivo." ) )
-            rec.state = "active"
+        self._apply_state_transition ( "activate" )
 
     def action_expire(self) :
-        for rec in self :
-            if rec.state != "active" :
-                raise UserError ( _ ( "Solo puedes vencer un aval vigente." ) )
-            rec.state = "expired"
+        self._apply_state_transition ( "expire" )
 
     def action_cancel(self) :
-        for rec in self :
-            if rec.state in ("expired", "cancelled") :
-                continue
-            rec.state = "cancelled"
+        self._apply_state_transition ( "cancel" )
 
     def action_set_draft(self) :
-        for rec in self :
-            rec.state = "draft"
+        self._apply_state_transition ( "set_draft" )
+
+    # ---------------------------------------------------------------------
+    # Sincronización del PDF con Documents
+    # ---------------------------------------------------------------------
+    _PDF_DOCUMENT_TRIGGERS = {"pdf_aval", "reference"}
+
+    def _get_pdf_document_name(self) :
+        self.ensure_one ()
+        return (self.reference or self.name or "").strip () or "Aval"
+
+    def _sync_pdf_documents(self) :
+        """
+        Crea/actualiza el documents.document de cada aval con PDF en la carpeta AVALES.
+
+        El documento apunta al mismo ir.attachment del campo pdf_aval (mismo checksum en el
+        filestore): no se copia ni se re-codifica el binario. Si el documento ya existe solo
+        se escriben los metadatos que cambian (nombre, cliente, carpeta) y, si tenía una
+        copia propia del PDF con el mismo checksum, se enlaza al adjunto del campo y se
+        elimina la copia duplicada.
+
+        Por lotes: una búsqueda de adjuntos y otra de documentos para todo el recordset,
+        un create() con los documentos que faltan y un write() por grupo de valores iguales.
+        Como la antigua acción automática, en sudo: el gestor de avales no tiene por qué
+        tener permisos en Documents.
+        """
+        # Guard: durante instalación / actualización de módulos, cargas masivas o imports
+        ctx = self.env.context
+        if ctx.get ( "install_mode" ) or ctx.get ( "module_install" ) or ctx.get (
+                "module_uninstall" ) or ctx.get ( "import_file" ) :
+            return
+        # Importación masiva: se sincroniza una vez al final (import_bonds)
+        if ctx.get ( "sid_bonds_skip_pdf_sync" ) :
+            return
+        if "documents.document" not in self.env or not self.ids :
+            return
+        folder_id = self._get_cached_ref_id ( "sid_bankbonds_mod.folder_avales" )
+        if not folder_id :
+            return
+
+        Document = self.env["documents.document"].sudo ()
+        attachments = self.env["ir.attachment"].sudo ().search ( [
+            ("res_model", "=", self._name),
+            ("res_field", "=", "pdf_aval"),
+            ("res_id", "in", self.ids),
+        ] )
+        attachment_by_bond = {att.res_id : att for att in attachments}
+        if not attachment_by_bond :
+            return
+
+        document_by_bond = {}
+        for document in Document.search ( [
+            ("res_model", "=", self._name),
+            ("res_id", "in", list ( attachment_by_bond )),
+            ("folder_id", "=", folder_id),
+        ], order="id" ) :
+            document_by_bond.setdefault ( document.res_id, document )
+
+        create_vals = []
+        updates = {}  # {vals congelados: ids de documents}
+        duplicates = self.env["ir.attachment"].sudo ()
+        for bond in self :
+            attachment = attachment_by_bond.get ( bond.id )
+            if not attachment :
+                continue
+            document_vals = {
+                "name" : bond._get_pdf_document_name (),
+                "partner_id" : bond.partner_id.id,
+                "folder_id" : folder_id,
+            }
+            document = document_by_bond.get ( bond.id )
+            if not document :
+                create_vals.append ( dict ( document_vals, attachment_id=attachment.id ) )
+                continue
+
+            old_attachment = document.attachment_id
+            if old_attachment != attachment :
+                document_vals["attachment_id"] = attachment.id
+                if old_attachment and not old_attachment.res_field \
+                        and old_attachment.checksum == attachment.checksum :
+                    duplicates |= old_attachment
+            changed = {
+                key : value for key, value in document_vals.items ()
+                if (document[key].id if key.endswith ( "_id" ) else document[key]) != value
+            }
+            if changed :
+                updates.setdefault ( tuple ( sorted ( changed.items () ) ), [] ).append ( document.id )
+
+        if create_vals :
+            Document.create ( create_vals )
+        for frozen_vals, document_ids in updates.items () :
+            Document.browse ( document_ids ).write ( dict ( frozen_vals ) )
+        if duplicates :
+            duplicates.unlink ()
+
+    def _detach_pdf_documents(self) :
+        """
+        documents.document.attachment_id es ondelete="cascade": al vaciar pdf_aval o borrar
+        el aval, el adjunto del campo se borra y con él el documento de AVALES. Antes, cada
+        documento pasa a una copia propia del PDF (adjunto del documento, como un fichero
+        subido a Documents) y se conserva. El filestore deduplica por checksum: la copia
+        no duplica el fichero. En sudo, como _sync_pdf_documents.
+        """
+        if "documents.document" not in self.env or not self.ids :
+            return
+        attachments = self.env["ir.attachment"].sudo ().search ( [
+            ("res_model", "=", self._name),
+            ("res_field", "=", "pdf_aval"),
+            ("res_id", "in", self.ids),
+        ] )
+        if not attachments :
+            return
+        documents = self.env["documents.document"].sudo ().search ( [("attachment_id", "in", attachments.ids)] )
+        for document in documents :
+            attachment = document.attachment_id
+            copy = attachment.copy ( {
+                "res_model" : "documents.document",
+                "res_id" : document.id,
+                "res_field" : False,
+                "raw" : attachment.raw,
+            } )
+            document.write ( {"attachment_id" : copy.id} )
+
+    def action_export_stream(self, export_format="csv") :
+        """
+        Exportación en streaming (controlador /sid_bankbonds_mod/bonds/export) de los avales
+        seleccionados o, si se marcó "seleccionar todo", del dominio de la lista. La selección
+        se guarda en servidor (sid_bonds_export_request): la URL solo lleva su id, y active_ids
+        (limitado por el cliente web) no recorta la exportación.
+        """
+        domain = [("id", "in", self.ids)]
+        # El cliente web envía active_domain siempre: solo cuenta si active_ids llegó al
+        # límite (web.active_ids_limit) y el dominio tiene más avales ("seleccionar todo")
+        active_domain = self.env.context.get ( "active_domain" )
+        if active_domain is not None :
+            limit = int ( self.env["ir.config_parameter"].sudo ().get_param ( "web.active_ids_limit", 20000 ) )
+            if len ( self ) >= limit and self.search_count ( active_domain ) > len ( self ) :
+                domain = active_domain
+        export_request = self.env["sid_bonds_export_request"].create ( {"domain" : json.dumps ( domain )} )
+        return {
+            "type" : "ir.actions.act_url",
+            "url" : "/sid_bankbonds_mod/bonds/export?%s" % url_encode ( {
+                "format" : export_format,
+                "export_id" : export_request.id,
+            } ),
+            "target" : "self",
+        }
+
+    @api.model
+    def _reserve_sequence_names(self, count) :
+        """
+        Reserva count nombres de la secuencia sid_bonds_orders en una sola ida y vuelta:
+        nextval() sobre generate_series (implementación estándar) o un único incremento
+        de number_next (no_gap). Devuelve None si no aplica (sin secuencia o con rangos de
+        fechas): el llamante usa entonces next_by_code por registro.
+        """
+        IrSequence = self.env["ir.sequence"]
+        IrSequence.check_access_rights ( "read" )
+        sequence = IrSequence.search ( [
+            ("code", "=", "sid_bonds_orders"),
+            ("company_id", "in", [self.env.company.id, False]),
+        ], order="company_id", limit=1 )
+        if not sequence or sequence.use_date_range :
+            return None
+
+        if sequence.implementation == "standard" :
+            self.env.cr.execute (
+                "SELECT nextval(%s::regclass) FROM generate_series(1, %s)",
+                ("ir_sequence_%03d" % sequence.id, count),
+            )
+            numbers = sorted ( row[0] for row in self.env.cr.fetchall () )
+        else :
+            step = sequence.number_increment
+            first = sequence._update_nogap ( step * count )
+            numbers = [first + step * i for i in range ( count )]
+        return [sequence.get_next_char ( number ) for number in numbers]
 
     @api.model_create_multi
     def create(self, vals_list) :
+        # Nombre definitivo antes del INSERT (sin UPDATE ni tracking posterior por aval)
+        new_label = _ ( "New" )
+        pending = [vals for vals in vals_list if vals.get ( "name", new_label ) == new_label]
+        if pending :
+            names = self._reserve_sequence_names ( len ( pending ) )
+            for index, vals in enumerate ( pending ) :
+                if names is not None :
+                    name = names[index]
+                else :
+                    name = self.env["ir.sequence"].next_by_code ( "sid_bonds_orders" )
+                vals["name"] = name or new_label
+
         records = super ().create ( vals_list )
-        for rec in records :
-            if rec.name == _ ( "New" ) :
-                rec.name = self.env["ir.sequence"].next_by_code (
-                    "sid_bonds_orders" ) or _ ( "New" )
+        # Sin leer el binario: basta con saber qué vals traían PDF
+        records.browse ( [rec.id for rec, vals in zip ( records, vals_list ) if vals.get ( "pdf_aval" )] ) \
+            ._sync_pdf_documents ()
         return records
 
     def unlink(self) :
@@ -428,6 +992,7 @@ class BondsOrder ( models.Model ) :
             if rec.state in ("active", "expired") :
                 raise UserError (
                     _ ( "No puedes eliminar avales vigentes o vencidos." ) )
+        self._detach_pdf_documents ()
         return super ().unlink ()
 
 
@@ -478,29 +1043,63 @@ class SaleQuotationsBonds(models.Model):
         readonly=True,
     )
 
-    # Campo para mostrar SOLO los confirmados (state='sale')
+    # Pedidos confirmados (state='sale') de toda la familia, materializados SOLO en el
+    # contrato principal (sid_quotation_family_order_rel): una fila por pedido de la familia,
+    # no una por adenda y pedido, y confirmar un pedido solo reescribe las filas del principal.
+    # Las adendas quedan vacías y leen la familia a través de su principal.
+    family_order_ids = fields.Many2many (
+        comodel_name="sale.order",
+        relation="sid_quotation_family_order_rel",
+        column1="quotation_id",
+        column2="order_id",
+        string="Pedidos confirmados (familia)",
+        compute="_compute_family_order_ids",
+        store=True,
+        readonly=True,
+        copy=False,
+    )
+
+    # Campo para mostrar SOLO los confirmados de la familia, en el principal y en sus adendas
     sale_order_sale_ids = fields.Many2many (
         comodel_name="sale.order",
         string="Pedidos confirmados",
         compute="_compute_sale_order_sale_ids",
-        store=False,
+        search="_search_sale_order_sale_ids",
         readonly=True,
     )
 
     @api.depends (
         "parent_id",
         "child_ids",
-        "parent_path",
         "sale_order_ids.state",
         "child_ids.sale_order_ids.state",
-        "parent_id.sale_order_ids.state",
     )
+    def _compute_family_order_ids(self) :
+        roots = self.filtered ( lambda r : not r.parent_id )
+        orders_map = roots._get_family_confirmed_orders_map ()
+        for rec in self :
+            if rec.parent_id :
+                rec.family_order_ids = False
+            elif rec.id in orders_map :
+                rec.family_order_ids = orders_map[rec.id]
+            else :
+                # Fallback onchange (root sin guardar): lo que hay en memoria
+                rec.family_order_ids = (rec | rec.child_ids).mapped ( "sale_order_ids" ).filtered (
+                    lambda so : so.state == "sale" )
+
+    @api.depends ( "parent_id", "family_order_ids", "parent_id.family_order_ids" )
     def _compute_sale_order_sale_ids(self) :
         for rec in self :
-            family = rec._get_family_quotations ()
-            orders = family.mapped ( "sale_order_ids" ).filtered (
-                lambda so : so.state == "sale" )
-            rec.sale_order_sale_ids = orders
+            rec.sale_order_sale_ids = (rec.parent_id or rec).family_order_ids
+
+    def _search_sale_order_sale_ids(self, operator, value) :
+        # La familia solo se guarda en el principal: un principal se busca por la suya y una
+        # adenda por la de su principal (la propia está siempre vacía)
+        return [
+            "|",
+            "&", ("parent_id", "=", False), ("family_order_ids", operator, value),
+            ("parent_id.family_order_ids", operator, value),
+        ]
 
     @api.depends("sale_order_ids.state", "sale_order_ids.partner_id", "sale_order_ids.date_order")
     def _compute_sale_partner_id(self) :
@@ -510,7 +1109,15 @@ class SaleQuotationsBonds(models.Model):
         - Resuelve partner por el pedido confirmado más reciente.
         - Si hay varios partners, solo lo registra en log (y además se salta en install_mode).
         """
-        for rec in self :
+        saved = self.filtered ( lambda r : r.id and not isinstance ( r.id, models.NewId ) )
+        partner_map = saved._get_latest_confirmed_partner_map ()
+        for rec in saved :
+            rec.partner_id = partner_map.get ( rec.id, False )
+        if saved and not self.env.context.get ( "install_mode" ) :
+            saved._log_multiple_confirmed_partners ()
+
+        # Registros en memoria (onchange): resolución en Python sobre lo cargado
+        for rec in self - saved :
             orders = rec.sale_order_ids.filtered(
                 lambda so: so.state == "sale"
             ).filtered(
@@ -541,6 +1148,126 @@ class SaleQuotationsBonds(models.Model):
                     rec.partner_id.display_name if rec.partner_id else "N/A",
                 )
 
+    # --- Agregados de familia (solo en el contrato principal / root) ---
+    family_currency_id = fields.Many2one(
+        "res.currency", string="Moneda familia",
+        compute="_compute_family_aggregates", store=True)
+    family_confirmed_untaxed = fields.Monetary(
+        string="Base confirmada familia", currency_field="family_currency_id",
+        compute="_compute_family_aggregates", store=True)
+    family_bond_amount = fields.Monetary(
+        string="Importe avalado familia", currency_field="family_currency_id",
+        compute="_compute_family_aggregates", store=True)
+    family_open_bond_count = fields.Integer(
+        string="Nº avales abiertos familia",
+        compute="_compute_family_aggregates", store=True)
+    family_coverage_ratio = fields.Float(
+        string="Cobertura familia (%)",
+        compute="_compute_family_aggregates", store=True, group_operator="avg",
+        help="Importe avalado / base confirmada de la familia, en moneda de la compañía del contrato. "
+             "Las conversiones usan el tipo de cambio del día en que se recalcula (cambios en "
+             "pedidos o avales de la familia); no se actualizan al cambiar los tipos.")
+
+    @api.depends(
+        "parent_id",
+        "child_ids",
+        "family_order_ids",
+        "family_order_ids.amount_untaxed",
+        "family_order_ids.currency_id",
+        "bond_ids",
+        "bond_ids.amount",
+        "bond_ids.currency_id",
+        "bond_ids.state_manage",
+        "child_ids.bond_ids",
+        "child_ids.bond_ids.amount",
+        "child_ids.bond_ids.currency_id",
+        "child_ids.bond_ids.state_manage",
+    )
+    def _compute_family_aggregates(self):
+        roots = self.filtered(
+            lambda r: not r.parent_id and r.id and not isinstance(r.id, models.NewId))
+        aggregates = roots._read_family_aggregates()
+        for rec in self:
+            untaxed, bonded, open_count = aggregates.get(rec.id, (0.0, 0.0, 0))
+            rec.family_currency_id = rec._get_family_aggregate_company().currency_id
+            rec.family_confirmed_untaxed = untaxed
+            rec.family_bond_amount = bonded
+            rec.family_open_bond_count = open_count
+            rec.family_coverage_ratio = bonded / untaxed * 100.0 if untaxed else 0.0
+
+    def _get_family_aggregate_company(self):
+        """
+        Compañía en cuya moneda se expresan los agregados: la del contrato o, si no tiene,
+        la principal. Nunca la del usuario que dispara el recálculo (el valor es almacenado).
+        """
+        self.ensure_one()
+        company = self.company_id if "company_id" in self._fields else self.env["res.company"]
+        return company or self.env.ref("base.main_company", raise_if_not_found=False) \
+            or self.env["res.company"].sudo().search([], order="id", limit=1)
+
+    def _read_family_aggregates(self):
+        """
+        {root_id: (base confirmada, importe avalado, nº avales abiertos)} para los contratos
+        principales del recordset: una consulta para pedidos y otra para avales (distintos
+        dentro de la familia). Importes convertidos a la moneda de la compañía del contrato
+        (_get_family_aggregate_company) al tipo del día del recálculo, una conversión por
+        (familia, moneda).
+        """
+        if not self:
+            return {}
+        self.flush(["parent_id", "family_order_ids"])
+        self.env["sale.order"].flush(["amount_untaxed", "currency_id"])
+        self.env["sid_bonds_orders"].flush(["amount", "currency_id", "state_manage"])
+
+        ids = tuple(self.ids)
+        cr = self.env.cr
+        cr.execute(
+            """
+            SELECT fr.quotation_id, so.currency_id, SUM(so.amount_untaxed)
+              FROM sid_quotation_family_order_rel fr
+              JOIN sale_order so ON so.id = fr.order_id
+             WHERE fr.quotation_id IN %s
+             GROUP BY fr.quotation_id, so.currency_id
+            """,
+            (ids,),
+        )
+        untaxed_rows = cr.fetchall()
+        cr.execute(
+            """
+            SELECT fam.root_id, b.currency_id, SUM(b.amount),
+                   COUNT(*) FILTER (WHERE b.state_manage IN ('new', 'current'))
+              FROM (
+                    SELECT DISTINCT q.root_id, rel.bond_id
+                      FROM (SELECT id AS root_id, id AS quotation_id FROM sale_quotations WHERE id IN %s
+                            UNION ALL
+                            SELECT parent_id, id FROM sale_quotations WHERE parent_id IN %s) q
+                      JOIN sid_bonds_quotation_rel rel ON rel.quotation_id = q.quotation_id
+                   ) fam
+              JOIN sid_bonds_orders b ON b.id = fam.bond_id
+             GROUP BY fam.root_id, b.currency_id
+            """,
+            (ids, ids),
+        )
+        bond_rows = cr.fetchall()
+
+        companies = {rec.id: rec._get_family_aggregate_company() for rec in self}
+        today = fields.Date.context_today(self)
+        Currency = self.env["res.currency"]
+
+        def _to_company(amount, currency_id, company):
+            currency = Currency.browse(currency_id)
+            if not amount or not currency or currency == company.currency_id:
+                return amount or 0.0
+            return currency._convert(amount, company.currency_id, company, today)
+
+        result = {rec_id: [0.0, 0.0, 0] for rec_id in ids}
+        for root_id, currency_id, amount in untaxed_rows:
+            result[root_id][0] += _to_company(amount, currency_id, companies[root_id])
+        for root_id, currency_id, amount, open_count in bond_rows:
+            result[root_id][1] += _to_company(amount, currency_id, companies[root_id])
+            result[root_id][2] += open_count
+        return {rec_id: tuple(values) for rec_id, values in result.items()}
+
     # --- Smart button counters ---
     child_count = fields.Integer(string="Nº Adendas", compute="_compute_smart_counts")
     sale_order_count = fields.Integer(string="Nº Pedidos", compute="_compute_smart_counts")
@@ -549,22 +1276,63 @@ class SaleQuotationsBonds(models.Model):
 
     @api.depends("child_ids", "sale_order_sale_ids", "bond_ids", "sale_order_sale_ids.procurement_group_id")
     def _compute_smart_counts(self):
-        po_model = self.env["purchase.order"].sudo()
-        group_ids = self.mapped("sale_order_sale_ids.procurement_group_id").ids
-        purchase_map = {}
-        if group_ids:
-            grouped = po_model.read_group(
-                [("group_id", "in", group_ids)],
-                ["group_id"],
-                ["group_id"],
-                lazy=False,
-            )
-            purchase_map = {item["group_id"][0]: item["group_id_count"] for item in grouped if item.get("group_id")}
-        for rec in self:
+        saved = self.filtered(lambda r: r.id and not isinstance(r.id, models.NewId))
+        counts = saved._read_smart_counts()
+        for rec in saved:
+            rec.child_count, rec.sale_order_count, rec.bond_count, rec.purchase_count = counts.get(
+                rec.id, (0, 0, 0, 0))
+
+        # Registros en memoria (onchange): recuento sobre lo cargado
+        for rec in self - saved:
             rec.child_count = len(rec.child_ids)
             rec.sale_order_count = len(rec.sale_order_sale_ids)
             rec.bond_count = len(rec.bond_ids)
-            rec.purchase_count = sum(purchase_map.get(gid, 0) for gid in rec._get_procurement_groups().ids)
+            rec.purchase_count = self.env["purchase.order"].sudo().search_count(rec._get_purchase_domain())
+
+    def _read_smart_counts(self):
+        """
+        {rec.id: (adendas, pedidos confirmados, avales, compras)} con una consulta agrupada
+        por contador para todo el recordset, sin cargar los registros relacionados. Pedidos
+        y compras son de la familia: se leen en la fila del principal.
+        """
+        if not self:
+            return {}
+        self.flush(["parent_id", "family_order_ids"])
+        self.env["purchase.order"].flush(["group_id"])
+        self.env["sale.order"].flush(["procurement_group_id"])
+
+        ids = tuple(self.ids)
+        root_by_id = {rec.id: (rec.parent_id or rec).id for rec in self}
+        root_ids = tuple(set(root_by_id.values()))
+        queries = [
+            ("""
+            SELECT parent_id, COUNT(*) FROM sale_quotations
+             WHERE parent_id IN %s GROUP BY parent_id
+            """, False),
+            ("""
+            SELECT quotation_id, COUNT(*) FROM sid_quotation_family_order_rel
+             WHERE quotation_id IN %s GROUP BY quotation_id
+            """, True),
+            ("""
+            SELECT quotation_id, COUNT(*) FROM sid_bonds_quotation_rel
+             WHERE quotation_id IN %s GROUP BY quotation_id
+            """, False),
+            ("""
+            SELECT fr.quotation_id, COUNT(DISTINCT po.id)
+              FROM sid_quotation_family_order_rel fr
+              JOIN sale_order so ON so.id = fr.order_id
+              JOIN purchase_order po ON po.group_id = so.procurement_group_id
+             WHERE fr.quotation_id IN %s
+             GROUP BY fr.quotation_id
+            """, True),
+        ]
+        counts = {rec_id: [0, 0, 0, 0] for rec_id in ids}
+        for position, (query, by_root) in enumerate(queries):
+            self.env.cr.execute(query, (root_ids if by_root else ids,))
+            result = dict(self.env.cr.fetchall())
+            for rec_id in ids:
+                counts[rec_id][position] = result.get(root_by_id[rec_id] if by_root else rec_id, 0)
+        return {rec_id: tuple(values) for rec_id, values in counts.items()}
 
     # --- Helpers for purchases ---
     def _get_procurement_groups(self):
@@ -640,51 +1408,140 @@ class SaleQuotationsBonds(models.Model):
             "context": {},
         }
 
+    def _get_latest_confirmed_partner_map(self):
+        """
+        {quotation_id: partner_id} del pedido confirmado (state='sale') más reciente de cada
+        contrato del recordset, en una sola consulta DISTINCT ON. Empates por id descendente,
+        igual que el orden por defecto de sale.order. Contratos sin pedidos: no aparecen.
+        """
+        ids = tuple(rec_id for rec_id in self.ids if isinstance(rec_id, int))
+        if not ids:
+            return {}
+        self.env["sale.order"].flush(["quotations_id", "state", "partner_id", "date_order"])
+        self.env.cr.execute(
+            """
+            SELECT DISTINCT ON (quotations_id) quotations_id, partner_id
+              FROM sale_order
+             WHERE quotations_id IN %s
+               AND state = 'sale'
+               AND partner_id IS NOT NULL
+             ORDER BY quotations_id, date_order DESC NULLS LAST, id DESC
+            """,
+            (ids,),
+        )
+        return dict(self.env.cr.fetchall())
+
+    def _log_multiple_confirmed_partners(self):
+        """Solo log (nunca chatter) de contratos con pedidos confirmados de varios clientes."""
+        self.env.cr.execute(
+            """
+            SELECT quotations_id, array_agg(DISTINCT partner_id)
+              FROM sale_order
+             WHERE quotations_id IN %s
+               AND state = 'sale'
+               AND partner_id IS NOT NULL
+             GROUP BY quotations_id
+            HAVING COUNT(DISTINCT partner_id) > 1
+            """,
+            (tuple(self.ids),),
+        )
+        for quotation_id, partner_ids in self.env.cr.fetchall():
+            rec = self.browse(quotation_id)
+            _logger.warning(
+                "sale.quotations %s: múltiples clientes en pedidos confirmados (%s). "
+                "Se fija el del pedido más reciente: %s",
+                rec.display_name,
+                ", ".join(self.env["res.partner"].browse(partner_ids).mapped("display_name")),
+                rec.partner_id.display_name if rec.partner_id else "N/A",
+            )
+
     def _get_effective_partner_from_sale_orders(self):
         """Devuelve el partner del pedido confirmado más reciente (state='sale')."""
         self.ensure_one()
+        if self.id and not isinstance(self.id, models.NewId):
+            return self.env["res.partner"].browse(self._get_latest_confirmed_partner_map().get(self.id))
         so = self.sale_order_ids.filtered(lambda s: s.state == "sale")
         if not so:
             return self.env["res.partner"]  # vacío
         so_latest = so.sorted(lambda s: s.date_order or fields.Datetime.now(), reverse=True)[:1]
         return so_latest.partner_id
 
-    def _get_family_quotations(self) :
-        """Devuelve root + descendientes. Soporta registros nuevos (NewId) en onchange."""
-        self.ensure_one ()
+    def _get_families_map(self):
+        """
+        {rec.id: sale.quotations (root + descendientes)} para todo el recordset con una sola
+        búsqueda por prefijos de parent_path. El root es el principal (o el propio registro).
+        Los registros cuyo root no está guardado (NewId) no aparecen.
+        """
+        roots = {}
+        for rec in self:
+            root = rec.parent_id or rec
+            if root.id and not isinstance(root.id, models.NewId) and root.parent_path:
+                roots[rec.id] = root
+        if not roots:
+            return {}
+
+        root_records = self.browse({root.id for root in roots.values()})
+        domain = expression.OR([
+            [("parent_path", "=like", root.parent_path + "%")] for root in root_records
+        ])
+        members = self.search(domain)
+
+        family_by_root = {root.id: [] for root in root_records}
+        for member in members:
+            for ancestor_id in member.parent_path.split("/")[:-1]:
+                if int(ancestor_id) in family_by_root:
+                    family_by_root[int(ancestor_id)].append(member.id)
+        return {
+            rec_id: self.browse(family_by_root[root.id])
+            for rec_id, root in roots.items()
+        }
 
-        # 1) si soy adenda, el root es mi parent (si existe), si no, yo
-        root = self.parent_id or self
-
-        # 2) Si el root aún no está guardado, NO se puede usar child_of en SQL
-        if not root.id or isinstance ( root.id, models.NewId ) :
-            # En onchange solo podemos devolver lo que "vemos" en memoria
-            # - yo mismo
-            # - mis child_ids (si yo soy root)
-            # - o los siblings si soy child y el parent tiene child_ids en memoria
-            if self.parent_id :
-                # soy adenda: familia = parent + siblings + yo (lo que haya cargado en pantalla)
-                fam = self.parent_id | self.parent_id.child_ids
-                return fam
-            else :
-                # soy principal nuevo: familia = yo + mis child_ids (en memoria)
-                return self | self.child_ids
+    def _get_family_confirmed_orders_map(self):
+        """{rec.id: sale.order confirmados de la familia}: una búsqueda de familias y otra de pedidos."""
+        families = self._get_families_map()
+        if not families:
+            return {}
+        family_ids = set()
+        for family in families.values():
+            family_ids.update(family.ids)
+
+        orders = self.env["sale.order"].search([
+            ("quotations_id", "in", list(family_ids)),
+            ("state", "=", "sale"),
+        ])
+        orders_by_quotation = {}
+        for order in orders:
+            orders_by_quotation.setdefault(order.quotations_id.id, []).append(order.id)
 
-        # 3) Caso normal (guardado): SQL con child_of (rápido y completo)
-        return self.search ( [("id", "child_of", root.id)] )
+        SaleOrder = self.env["sale.order"]
+        return {
+            rec_id: SaleOrder.browse([
+                order_id for quotation_id in family.ids
+                for order_id in orders_by_quotation.get(quotation_id, [])
+            ])
+            for rec_id, family in families.items()
+        }
 
     @api.constrains("parent_id", "child_ids")
     def _check_parent_child_consistency(self):
+        # Un único resolvedor para los contratos, sus principales y sus adendas
+        related = self | self.mapped("parent_id") | self.mapped("child_ids")
+        partner_map = related._get_latest_confirmed_partner_map()
+        Partner = self.env["res.partner"]
+
+        def _partner(quotation):
+            return Partner.browse(partner_map.get(quotation.id))
+
         for rec in self:
             if rec.parent_id and rec.child_ids:
                 raise ValidationError(
                     _("Un contrato no puede tener 'Principal' y 'Adendas' a la vez.")
                 )
-            rec_partner = rec._get_effective_partner_from_sale_orders()
+            rec_partner = _partner(rec)
 
             # --- Regla 1: si es adenda (tiene parent), el parent debe tener mismo cliente ---
             if rec.parent_id:
-                parent_partner = rec.parent_id._get_effective_partner_from_sale_orders()
+                parent_partner = _partner(rec.parent_id)
 
                 # Si ambos tienen partner “resuelto” y no coincide -> bloquear
                 if rec_partner and parent_partner and rec_partner.id != parent_partner.id:
@@ -699,7 +1556,7 @@ class SaleQuotationsBonds(models.Model):
             # --- Regla 2: si es principal (tiene children), todos deben tener mismo cliente ---
             if rec.child_ids:
                 for child in rec.child_ids:
-                    child_partner = child._get_effective_partner_from_sale_orders()
+                    child_partner = _partner(child)
                     if rec_partner and child_partner and rec_partner.id != child_partner.id:
                         raise ValidationError(_(
                             "No puedes añadir una adenda con cliente distinto al del contrato principal.\n\n"
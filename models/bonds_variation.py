@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+from odoo import _, api, fields, models
+from odoo.tools import format_amount, html_escape
+
+_logger = logging.getLogger(__name__)
+
+
+class BondsVariation(models.Model):
+    """Cola de variaciones de Base Imponible Pedidos pendientes de notificar a los gestores."""
+    _name = "sid_bonds_variation"
+    _description = "Variaciones de avales pendientes de notificar"
+    _order = "id"
+
+    # Días que se conservan las variaciones ya enviadas en el resumen
+    _SENT_RETENTION_DAYS = 30
+
+    bond_id = fields.Many2one(
+        "sid_bonds_orders",
+        string="Aval",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    currency_id = fields.Many2one(related="bond_id.currency_id")
+    old_value = fields.Monetary(string="Base anterior", currency_field="currency_id")
+    new_value = fields.Monetary(string="Base nueva", currency_field="currency_id")
+    pct = fields.Float(string="Cambio (%)")
+    threshold = fields.Float(string="Umbral (%)")
+    state = fields.Selection(
+        [("pending", "Pendiente"), ("sent", "Enviado")],
+        string="Estado",
+        default="pending",
+        required=True,
+        index=True,
+    )
+
+    def _get_digest_recipients(self):
+        """Partners que reciben el resumen: todos los gestores reciben las mismas variaciones."""
+        return self.env["sid_bonds_orders"]._get_bonds_manager_partners()
+
+    def _render_digest_body(self):
+        rows = []
+        for variation in self:
+            bond = variation.bond_id
+            url = "/web#id=%s&model=%s&view_type=form" % (bond.id, bond._name)
+            rows.append(
+                "<tr><td><a href=\"%s\">%s</a></td><td>%s</td><td>%s</td><td>%s</td><td>%.2f%%</td></tr>" % (
+                    url,
+                    html_escape(bond.display_name),
+                    html_escape(bond.partner_id.display_name or ""),
+                    html_escape(format_amount(self.env, variation.old_value, variation.currency_id)),
+                    html_escape(format_amount(self.env, variation.new_value, variation.currency_id)),
+                    variation.pct,
+                )
+            )
+        return _(
+            "<p><b>Variaciones en Base Imponible Pedidos</b> (%(count)s avales)</p>"
+            "<table class=\"table table-sm\">"
+            "<thead><tr><th>Aval</th><th>Cliente</th><th>Anterior</th><th>Nuevo</th><th>Cambio</th></tr></thead>"
+            "<tbody>%(rows)s</tbody></table>"
+        ) % {"count": len(self.mapped("bond_id")), "rows": "".join(rows)}
+
+    @api.model
+    def _cron_send_digest(self):
+        """Un único mensaje (renderizado una vez) para todos los gestores con las variaciones pendientes."""
+        pending = self.search([("state", "=", "pending")])
+        if not pending:
+            return
+
+        partners = pending._get_digest_recipients()
+        if partners:
+            self.env["mail.thread"].message_notify(
+                partner_ids=partners.ids,
+                subject=_("Avales: variaciones en Base Imponible Pedidos"),
+                body=pending._render_digest_body(),
+            )
+
+        pending.write({"state": "sent"})
+        _logger.info("Digest de variaciones de avales: %s variaciones, %s destinatarios",
+                     len(pending), len(partners))
+
+    @api.autovacuum
+    def _gc_sent_variations(self):
+        """Las variaciones enviadas solo se guardan un tiempo (el detalle sigue en el chatter del aval)."""
+        limit = fields.Datetime.now() - timedelta(days=self._SENT_RETENTION_DAYS)
+        self.search([("state", "=", "sent"), ("write_date", "<", limit)]).unlink()
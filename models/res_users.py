@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, models
+
+
+# Métodos en ormcache de sid_bonds_orders que dependen de los gestores de avales
+_BONDS_MANAGER_CACHED_METHODS = (
+    "_get_cached_ref_id",
+    "_get_bonds_manager_partner_ids",
+    "_get_bonds_manager_mentions_html",
+)
+
+
+def _clear_bonds_manager_caches(env):
+    """
+    Invalida solo las entradas de los gestores de avales (ids de partners, menciones HTML y
+    xml-ids) en la caché del registry, no toda la caché: en 15.0 clear_caches() y
+    ormcache.clear_cache() la vacían entera. Los demás workers no tienen invalidación por
+    método: se les avisa por la señalización de la base de datos (cache_invalidated).
+    """
+    registry = env.registry
+    cache = registry._Registry__cache
+    for key in list(cache):
+        if key[0] == "sid_bonds_orders" and getattr(key[1], "__name__", None) in _BONDS_MANAGER_CACHED_METHODS:
+            try:
+                del cache[key]
+            except KeyError:
+                pass  # ya expulsada por el LRU
+    registry.cache_invalidated = True
+
+
+class ResGroups(models.Model):
+    _inherit = "res.groups"
+
+    def write(self, vals):
+        res = super().write(vals)
+        if "users" in vals or "implied_ids" in vals:
+            _clear_bonds_manager_caches(self.env)
+        return res
+
+
+class ResUsers(models.Model):
+    _inherit = "res.users"
+
+    # Campos de res.users que cambian quién es gestor de avales o su partner
+    _SID_BONDS_MANAGER_FIELDS = {"groups_id", "active", "partner_id"}
+
+    def _sid_bonds_has_manager(self):
+        """True si alguno de estos usuarios está ahora en el grupo Gestión de Avales."""
+        group_id = self.env["sid_bonds_orders"]._get_cached_ref_id("sid_bankbonds_mod.group_bonds_manager")
+        return bool(group_id) and any(group_id in user.groups_id.ids for user in self.sudo())
+
+    def _sid_bonds_had_manager(self):
+        """True si alguno de estos usuarios figura en la caché de gestores (antes del cambio)."""
+        manager_partner_ids = self.env["sid_bonds_orders"]._get_bonds_manager_partner_ids()
+        return bool(set(manager_partner_ids).intersection(self.sudo().mapped("partner_id").ids))
+
+    @api.model
+    def _sid_bonds_touches_managers(self, vals):
+        # El formulario de usuario escribe los grupos como campos in_group_N / sel_groups_N_M
+        return bool(self._SID_BONDS_MANAGER_FIELDS.intersection(vals)) or any(
+            key.startswith(("in_group_", "sel_groups_")) for key in vals)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        users = super().create(vals_list)
+        if users._sid_bonds_has_manager():
+            _clear_bonds_manager_caches(self.env)
+        return users
+
+    def write(self, vals):
+        if not self._sid_bonds_touches_managers(vals):
+            return super().write(vals)
+        had_manager = self._sid_bonds_had_manager()
+        res = super().write(vals)
+        if had_manager or self._sid_bonds_has_manager():
+            _clear_bonds_manager_caches(self.env)
+        return res
+
+    def unlink(self):
+        had_manager = self._sid_bonds_had_manager()
+        res = super().unlink()
+        if had_manager:
+            _clear_bonds_manager_caches(self.env)
+        return res
+
+
+class ResPartner(models.Model):
+    _inherit = "res.partner"
+
+    # Campos que alteran el display_name de un partner (o de sus contactos)
+    _SID_BONDS_MENTION_FIELDS = {"name", "parent_id", "commercial_company_name", "is_company"}
+
+    def write(self, vals):
+        res = super().write(vals)
+        # El display_name de un gestor ("Empresa, Nombre") forma parte del fragmento de
+        # menciones cacheado: vale tanto cambiar el gestor como su empresa
+        if self._SID_BONDS_MENTION_FIELDS.intersection(vals):
+            manager_partner_ids = self.env["sid_bonds_orders"]._get_bonds_manager_partner_ids()
+            if manager_partner_ids:
+                managers = self.browse(manager_partner_ids).sudo()
+                related = managers | managers.mapped("parent_id") | managers.mapped("commercial_partner_id")
+                if set(related.ids).intersection(self.ids):
+                    _clear_bonds_manager_caches(self.env)
+        return res
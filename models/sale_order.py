@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+
+from odoo import api, fields, models
+
+
+class SaleOrder(models.Model):
+    _inherit = "sale.order"
+
+    # Campos de sale.order que alteran la aportación del pedido a base_pedidos
+    _SID_BONDS_DELTA_FIELDS = {"state", "partner_id", "quotations_id", "amount_untaxed", "order_line"}
+
+    # Índice inverso pedido -> avales (vía quotations_id y sid_bonds_quotation_rel),
+    # mantenido por el ORM al cambiar el contrato del pedido o los contratos del aval.
+    sid_bond_ids = fields.Many2many(
+        comodel_name="sid_bonds_orders",
+        relation="sid_bonds_sale_order_rel",
+        column1="order_id",
+        column2="bond_id",
+        string="Avales",
+        compute="_compute_sid_bond_ids",
+        store=True,
+        copy=False,
+    )
+
+    @api.depends("quotations_id", "quotations_id.bond_ids")
+    def _compute_sid_bond_ids(self):
+        for order in self:
+            order.sid_bond_ids = order.quotations_id.bond_ids
+
+    def _sid_bonds_contributions(self):
+        """{bond_id: importe} que estos pedidos aportan hoy a base_pedidos de sus avales."""
+        contributions = defaultdict(float)
+        for order in self.sudo().filtered(lambda so: so.state == "sale" and so.partner_id):
+            for bond in order.sid_bond_ids:
+                if bond.partner_id == order.partner_id:
+                    contributions[bond.id] += order.amount_untaxed
+        return contributions
+
+    def _sid_bonds_snapshot(self):
+        """
+        Foto previa de las aportaciones. Antes se resuelven los recálculos pendientes de
+        base_pedidos: si se calculasen después, leerían ya el pedido nuevo y el delta
+        se sumaría dos veces.
+        En modo diferido solo interesan los avales a los que el pedido aporta (confirmado y
+        del mismo cliente), no los importes.
+        """
+        if self.env["sid_bonds_orders"]._get_base_pedidos_mode() == "deferred":
+            return dict.fromkeys(self._sid_bonds_contributions(), 0.0)
+        self.env["sid_bonds_orders"].recompute(["base_pedidos"])
+        return self._sid_bonds_contributions()
+
+    def _sid_bonds_apply_delta(self, old_contributions):
+        Bond = self.env["sid_bonds_orders"]
+        if Bond._get_base_pedidos_mode() == "deferred":
+            # Solo los avales a los que el pedido aportaba o aporta: editar un presupuesto
+            # o un pedido de otro cliente no bloquea ni marca avales
+            bond_ids = set(old_contributions) | set(self._sid_bonds_contributions())
+            if bond_ids:
+                Bond.browse(bond_ids)._apply_base_pedidos_delta({})
+            return
+        new_contributions = self._sid_bonds_contributions()
+        bond_ids = set(old_contributions) | set(new_contributions)
+        if not bond_ids:
+            return
+        deltas = {
+            bond_id: new_contributions.get(bond_id, 0.0) - old_contributions.get(bond_id, 0.0)
+            for bond_id in bond_ids
+        }
+        self.env["sid_bonds_orders"].browse(bond_ids)._apply_base_pedidos_delta(deltas)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        if self.env.context.get("sid_bonds_skip_delta"):
+            return super().create(vals_list)
+        # Como en _sid_bonds_snapshot: los recálculos pendientes, antes de insertar el pedido
+        self.env["sid_bonds_orders"].recompute(["base_pedidos"])
+        # Las líneas creadas desde aquí no aplican su propio delta (se sumaría dos veces)
+        orders = super(SaleOrder, self.with_context(sid_bonds_skip_delta=True)).create(vals_list)
+        orders = orders.with_env(self.env)
+        orders._sid_bonds_apply_delta({})
+        return orders
+
+    def write(self, vals):
+        if self.env.context.get("sid_bonds_skip_delta") or not self._SID_BONDS_DELTA_FIELDS.intersection(vals):
+            return super().write(vals)
+
+        old_contributions = self._sid_bonds_snapshot()
+        # Las líneas escritas desde aquí no deben aplicar su propio delta
+        res = super(SaleOrder, self.with_context(sid_bonds_skip_delta=True)).write(vals)
+        self._sid_bonds_apply_delta(old_contributions)
+        return res
+
+
+class SaleOrderLine(models.Model):
+    _inherit = "sale.order.line"
+
+    # Campos de línea que alteran amount_untaxed del pedido
+    _SID_BONDS_DELTA_FIELDS = {"product_id", "product_uom_qty", "product_uom", "price_unit", "discount", "tax_id"}
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        if self.env.context.get("sid_bonds_skip_delta"):
+            return super().create(vals_list)
+        orders = self.env["sale.order"].browse(
+            {vals["order_id"] for vals in vals_list if vals.get("order_id")})
+        old_contributions = orders._sid_bonds_snapshot()
+        lines = super().create(vals_list)
+        orders._sid_bonds_apply_delta(old_contributions)
+        return lines
+
+    def write(self, vals):
+        if self.env.context.get("sid_bonds_skip_delta") or not self._SID_BONDS_DELTA_FIELDS.intersection(vals):
+            return super().write(vals)
+        orders = self.mapped("order_id")
+        old_contributions = orders._sid_bonds_snapshot()
+        res = super().write(vals)
+        orders._sid_bonds_apply_delta(old_contributions)
+        return res
+
+    def unlink(self):
+        if self.env.context.get("sid_bonds_skip_delta"):
+            return super().unlink()
+        orders = self.mapped("order_id")
+        old_contributions = orders._sid_bonds_snapshot()
+        res = super().unlink()
+        orders.exists()._sid_bonds_apply_delta(old_contributions)
+        return res
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+def _bond_selection(field_name):
+    return lambda self: self.env["sid_bonds_orders"]._fields[field_name].selection
+
+
+class BondsExposureReport(models.Model):
+    """
+    Exposición de avales por compañía (la del banco), banco, cliente, moneda, gestión y tipo.
+
+    Vista materializada (agregados precalculados): pivot y gráficos leen pocas filas ya
+    agrupadas. Se refresca por cron o bajo demanda (REFRESH ... CONCURRENTLY, sin bloquear
+    las lecturas), así que puede ir por detrás de los avales hasta el siguiente refresco.
+    """
+    _name = "sid_bonds_exposure_report"
+    _description = "Exposición de avales"
+    _auto = False
+    _rec_name = "journal_id"
+    _order = "journal_id, partner_id, currency_id"
+
+    company_id = fields.Many2one("res.company", string="Compañía", readonly=True)
+    journal_id = fields.Many2one("account.journal", string="Banco", readonly=True)
+    partner_id = fields.Many2one("res.partner", string="Cliente", readonly=True)
+    currency_id = fields.Many2one("res.currency", string="Moneda", readonly=True)
+    state_manage = fields.Selection(_bond_selection("state_manage"), string="Gestión", readonly=True)
+    aval_type = fields.Selection(_bond_selection("aval_type"), string="Tipo", readonly=True)
+    amount = fields.Monetary(string="Importe", currency_field="currency_id", readonly=True)
+    base_pedidos = fields.Monetary(string="Base Imponible Pedidos", currency_field="currency_id", readonly=True)
+    bond_count = fields.Integer(string="Nº avales", readonly=True)
+    active_count = fields.Integer(string="Nº vigentes", readonly=True)
+
+    def _query(self):
+        return """
+            SELECT row_number() OVER (ORDER BY j.company_id, b.journal_id, b.partner_id, b.currency_id,
+                                               b.state_manage, b.aval_type) AS id,
+                   j.company_id,
+                   b.journal_id,
+                   b.partner_id,
+                   b.currency_id,
+                   b.state_manage,
+                   b.aval_type,
+                   SUM(COALESCE(b.amount, 0)) AS amount,
+                   SUM(COALESCE(b.base_pedidos, 0)) AS base_pedidos,
+                   COUNT(*) AS bond_count,
+                   COUNT(*) FILTER (WHERE b.state = 'active') AS active_count
+              FROM sid_bonds_orders b
+              LEFT JOIN account_journal j ON j.id = b.journal_id
+             GROUP BY j.company_id, b.journal_id, b.partner_id, b.currency_id, b.state_manage, b.aval_type
+        """
+
+    def init(self):
+        cr = self._cr
+        cr.execute("DROP MATERIALIZED VIEW IF EXISTS %s CASCADE" % self._table)
+        cr.execute("CREATE MATERIALIZED VIEW %s AS (%s)" % (self._table, self._query()))
+        # REFRESH ... CONCURRENTLY exige un índice único
+        cr.execute("CREATE UNIQUE INDEX %s_id_uniq ON %s (id)" % (self._table, self._table))
+        # Una fila por combinación agrupada (NULL = NULL: cliente o banco vacíos)
+        cr.execute("""
+            CREATE UNIQUE INDEX %s_group_uniq ON %s
+                (COALESCE(company_id, 0), COALESCE(journal_id, 0), COALESCE(partner_id, 0),
+                 COALESCE(currency_id, 0), COALESCE(state_manage, ''), COALESCE(aval_type, ''))
+        """ % (self._table, self._table))
+        cr.execute("CREATE INDEX %s_journal_idx ON %s (journal_id)" % (self._table, self._table))
+
+    @api.model
+    def _refresh(self):
+        self.env["sid_bonds_orders"].flush()
+        self.env.cr.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY %s" % self._table)
+        self.invalidate_cache()
+
+    @api.model
+    def action_refresh(self):
+        self._refresh()
+        return {"type": "ir.actions.client", "tag": "reload"}
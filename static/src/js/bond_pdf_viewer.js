@@ -0,0 +1,23 @@
+odoo.define('sid_bankbonds_mod.bond_pdf_viewer', function (require) {
+"use strict";
+
+var basicFields = require('web.basic_fields');
+var fieldRegistry = require('web.field_registry');
+
+/**
+ * Visor PDF del aval: en vez de /web/content (descarga completa en cada apertura) usa
+ * el controlador del módulo, que sirve el PDF por trozos con Range y ETag (304 si no cambia).
+ */
+var BondPdfViewer = basicFields.FieldPdfViewer.extend({
+    _getURI: function (fileURI) {
+        if (!fileURI && this.res_id && this.model === 'sid_bonds_orders') {
+            fileURI = '/sid_bankbonds_mod/bond/' + this.res_id + '/pdf';
+        }
+        return this._super(fileURI);
+    },
+});
+
+fieldRegistry.add('sid_bond_pdf_viewer', BondPdfViewer);
+
+return BondPdfViewer;
+});
@@ -1,3 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from . import test_bonds_order
+from . import test_base_pedidos
+from . import test_bonds_import
+from . import test_quotation_family
+from . import test_migrate_studio
+from . import test_bond_pdf_controller
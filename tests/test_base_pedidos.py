@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests.common import SavepointCase
+
+
+class TestBasePedidos(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Bond = cls.env["sid_bonds_orders"]
+        cls.partner = cls.env["res.partner"].create({"name": "Cliente Avales", "is_company": True})
+        cls.other_partner = cls.env["res.partner"].create({"name": "Otro Cliente", "is_company": True})
+        cls.product = cls.env["product.product"].create({"name": "Producto aval", "type": "service"})
+        cls.contract = cls.env["sale.quotations"].create({"name": "CTR-TEST-001"})
+
+    def _create_order(self, partner, price, contract=None):
+        return self.env["sale.order"].create({
+            "partner_id": partner.id,
+            "quotations_id": (contract or self.contract).id,
+            "order_line": [(0, 0, {
+                "product_id": self.product.id,
+                "product_uom_qty": 1,
+                "price_unit": price,
+                "tax_id": [(6, 0, [])],
+            })],
+        })
+
+    def test_base_pedidos_only_confirmed_orders_of_bond_partner(self):
+        confirmed = self._create_order(self.partner, 100.0)
+        confirmed.action_confirm()
+        self._create_order(self.partner, 40.0)  # borrador: no cuenta
+        other = self._create_order(self.other_partner, 70.0)
+        other.action_confirm()  # otro cliente: no cuenta
+
+        bond = self.Bond.create({
+            "partner_id": self.partner.id,
+            "contract_ids": [(6, 0, self.contract.ids)],
+        })
+        self.assertAlmostEqual(bond.base_pedidos, 100.0)
+
+    def test_base_pedidos_zero_without_partner_or_contracts(self):
+        self._create_order(self.partner, 100.0).action_confirm()
+
+        no_partner = self.Bond.create({"contract_ids": [(6, 0, self.contract.ids)]})
+        no_contracts = self.Bond.create({"partner_id": self.partner.id})
+        self.assertEqual(no_partner.base_pedidos, 0.0)
+        self.assertEqual(no_contracts.base_pedidos, 0.0)
+
+    def test_base_pedidos_delta_on_order_changes(self):
+        bond = self.Bond.create({
+            "partner_id": self.partner.id,
+            "contract_ids": [(6, 0, self.contract.ids)],
+        })
+        order = self._create_order(self.partner, 100.0)
+        self.assertEqual(order.sid_bond_ids, bond)
+        self.assertEqual(bond.base_pedidos, 0.0)
+
+        order.action_confirm()
+        self.assertAlmostEqual(bond.base_pedidos, 100.0)
+
+        order.order_line.write({"price_unit": 150.0})
+        self.assertAlmostEqual(bond.base_pedidos, 150.0)
+
+        order.write({"partner_id": self.other_partner.id})
+        self.assertAlmostEqual(bond.base_pedidos, 0.0)
+
+    def test_base_pedidos_order_created_confirmed_counted_once(self):
+        bond = self.Bond.create({
+            "partner_id": self.partner.id,
+            "contract_ids": [(6, 0, self.contract.ids)],
+        })
+        self.env["sale.order"].create({
+            "partner_id": self.partner.id,
+            "quotations_id": self.contract.id,
+            "state": "sale",
+            "order_line": [(0, 0, {
+                "product_id": self.product.id,
+                "product_uom_qty": 1,
+                "price_unit": 100.0,
+                "tax_id": [(6, 0, [])],
+            })],
+        })
+        self.assertAlmostEqual(bond.base_pedidos, 100.0)
+
+        # Aval con el cálculo pendiente (contratos recién cambiados) y pedido nuevo confirmado
+        other_contract = self.env["sale.quotations"].create({"name": "CTR-TEST-002"})
+        bond.write({"contract_ids": [(4, other_contract.id)]})
+        order = self._create_order(self.partner, 50.0, contract=other_contract)
+        order.action_confirm()
+        self.assertAlmostEqual(bond.base_pedidos, 150.0)
+
+    def test_base_pedidos_full_recompute_matches_delta(self):
+        bond = self.Bond.create({
+            "partner_id": self.partner.id,
+            "contract_ids": [(6, 0, self.contract.ids)],
+        })
+        self._create_order(self.partner, 80.0).action_confirm()
+        self._create_order(self.partner, 20.0).action_confirm()
+        delta_value = bond.base_pedidos
+
+        bond.write({"base_pedidos": 0.0})
+        bond.action_recompute_base_pedidos()
+        self.assertAlmostEqual(bond.base_pedidos, delta_value)
+        self.assertAlmostEqual(bond.base_pedidos, 100.0)
+
+    def test_base_pedidos_deferred_mode_drained_by_cron(self):
+        self.env["ir.config_parameter"].sudo().set_param("sid_bankbonds_mod.base_pedidos_mode", "deferred")
+        bond = self.Bond.create({
+            "partner_id": self.partner.id,
+            "contract_ids": [(6, 0, self.contract.ids)],
+        })
+        self._create_order(self.partner, 60.0).action_confirm()
+        self.assertTrue(bond.base_pedidos_dirty)
+        self.assertEqual(bond.base_pedidos, 0.0)
+
+        self.Bond._cron_process_dirty_bonds()
+        self.assertFalse(bond.base_pedidos_dirty)
+        self.assertAlmostEqual(bond.base_pedidos, 60.0)
+
+    def test_base_pedidos_deferred_mode_ignores_unrelated_orders(self):
+        self.env["ir.config_parameter"].sudo().set_param("sid_bankbonds_mod.base_pedidos_mode", "deferred")
+        bond = self.Bond.create({
+            "partner_id": self.partner.id,
+            "contract_ids": [(6, 0, self.contract.ids)],
+        })
+        draft = self._create_order(self.partner, 60.0)
+        other = self._create_order(self.other_partner, 30.0)
+        other.action_confirm()
+        draft.order_line.write({"price_unit": 80.0})
+        other.order_line.write({"price_unit": 40.0})
+        self.assertFalse(bond.base_pedidos_dirty)
+
+        draft.action_confirm()
+        self.assertTrue(bond.base_pedidos_dirty)
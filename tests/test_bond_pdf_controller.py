@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import base64
+
+from odoo.tests import HttpCase, tagged
+
+
+@tagged("post_install", "-at_install")
+class TestBondPdfController(HttpCase):
+
+    def setUp(self):
+        super().setUp()
+        self.pdf_content = b"%PDF-1.4 aval " + b"0123456789" * 10
+        self.bond = self.env["sid_bonds_orders"].create({
+            "reference": "BOND-HTTP-001",
+            "pdf_aval": base64.b64encode(self.pdf_content),
+        })
+        self.url = "/sid_bankbonds_mod/bond/%s/pdf" % self.bond.id
+        self.authenticate("admin", "admin")
+
+    def test_get_and_head(self):
+        response = self.url_open(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.pdf_content)
+        self.assertEqual(response.headers["Content-Type"], "application/pdf")
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertTrue(response.headers.get("ETag"))
+
+        response = self.url_open(self.url, head=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(int(response.headers["Content-Length"]), len(self.pdf_content))
+
+        # Solo GET y HEAD
+        response = self.url_open(self.url, data={"csrf_token": "x"})
+        self.assertEqual(response.status_code, 405)
+
+    def test_matching_etag_returns_304(self):
+        etag = self.url_open(self.url).headers["ETag"]
+        response = self.url_open(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        # Otro PDF: otro ETag, la revalidación vuelve a servir el fichero
+        self.bond.write({"pdf_aval": base64.b64encode(b"%PDF-1.4 nuevo")})
+        response = self.url_open(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"%PDF-1.4 nuevo")
+
+    def test_range_returns_partial_content(self):
+        response = self.url_open(self.url, headers={"Range": "bytes=0-7"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.pdf_content[:8])
+        self.assertEqual(
+            response.headers["Content-Range"], "bytes 0-7/%s" % len(self.pdf_content))
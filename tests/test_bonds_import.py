@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import base64
+
+from odoo.exceptions import ValidationError
+from odoo.tests.common import SavepointCase
+
+
+class TestBondsImport(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Bond = cls.env["sid_bonds_orders"]
+        cls.partner = cls.env["res.partner"].create({"name": "Cliente Import", "ref": "CLI-IMP"})
+        cls.contract = cls.env["sale.quotations"].create({"name": "CTR-IMPORT-1"})
+
+    def test_import_upserts_by_reference(self):
+        summary = self.Bond.import_bonds([
+            {"reference": "IMP-1", "partner": "CLI-IMP", "currency": "eur", "amount": "1500,50",
+             "due_date": "2030-01-31", "contracts": "CTR-IMPORT-1", "state": "Vigente"},
+            {"reference": "IMP-2", "partner": "Nadie"},
+            {"partner": "CLI-IMP"},
+        ])
+        self.assertEqual(summary["created"], 1)
+        self.assertEqual([line for line, _msg in summary["errors"]], [2, 3])
+
+        bond = self.Bond.search([("reference", "=", "IMP-1")])
+        self.assertEqual(bond.partner_id, self.partner)
+        self.assertEqual(bond.amount, 1500.5)
+        self.assertEqual(bond.state, "active")
+        self.assertEqual(bond.contract_ids, self.contract)
+
+        # Misma referencia: se actualiza; sin cambios: no se escribe
+        summary = self.Bond.import_bonds([
+            {"reference": "IMP-1", "amount": 2000},
+            {"reference": "IMP-1", "amount": 2500},
+        ])
+        self.assertEqual((summary["created"], summary["updated"]), (0, 1))
+        self.assertEqual(bond.amount, 2500.0)
+        summary = self.Bond.import_bonds([{"reference": "IMP-1", "amount": 2500}])
+        self.assertEqual((summary["updated"], summary["unchanged"]), (0, 1))
+
+    def test_import_partner_by_vat_with_contacts(self):
+        company = self.env["res.partner"].create({
+            "name": "Empresa NIF", "is_company": True, "vat": "ESA12345674",
+        })
+        self.env["res.partner"].create({"name": "Contacto NIF", "parent_id": company.id})
+        summary = self.Bond.import_bonds([{"reference": "IMP-VAT", "partner": "ESA12345674"}])
+        self.assertFalse(summary["errors"])
+        self.assertEqual(self.Bond.search([("reference", "=", "IMP-VAT")]).partner_id, company)
+
+    def test_duplicate_reference_readable_error(self):
+        self.Bond.create({"reference": "IMP-DUP"})
+        with self.assertRaises(ValidationError):
+            self.Bond.create({"reference": "IMP-DUP"})
+
+    def test_copy_bond_with_reference(self):
+        bond = self.Bond.create({"reference": "IMP-COPY"})
+        duplicate = bond.copy()
+        self.assertFalse(duplicate.reference)
+
+    def test_import_state_follows_transitions(self):
+        summary = self.Bond.import_bonds([
+            {"reference": "IMP-ST-1", "amount": 0, "state": "active"},
+            {"reference": "IMP-ST-2", "amount": 100, "state": "active"},
+        ])
+        self.assertEqual(summary["created"], 2)
+        self.assertEqual([line for line, _msg in summary["errors"]], [1])
+        bonds = self.Bond.search([("reference", "in", ["IMP-ST-1", "IMP-ST-2"])], order="reference")
+        self.assertEqual(bonds.mapped("state"), ["draft", "active"])
+
+    def test_import_pdf_unchanged_by_checksum(self):
+        pdf = base64.b64encode(b"%PDF-1.4 aval").decode()
+        self.Bond.import_bonds([{"reference": "IMP-PDF", "pdf": pdf}])
+        summary = self.Bond.import_bonds([{"reference": "IMP-PDF", "pdf": pdf}])
+        self.assertEqual((summary["updated"], summary["unchanged"]), (0, 1))
+
+        other = base64.b64encode(b"%PDF-1.4 aval v2").decode()
+        summary = self.Bond.import_bonds([{"reference": "IMP-PDF", "pdf": other}])
+        self.assertEqual(summary["updated"], 1)
+
+    def test_import_reports_rows_over_credit_line(self):
+        journal = self.env["account.journal"].create({"name": "Banco Import", "type": "bank", "code": "BIMP"})
+        currency = self.env.company.currency_id
+        line = self.env["sid_bonds_credit_line"].create({
+            "journal_id": journal.id, "currency_id": currency.id, "limit_amount": 1000.0,
+        })
+        summary = self.Bond.import_bonds([
+            {"reference": "IMP-CL-%s" % i, "journal": "BIMP", "currency": currency.name,
+             "amount": 600, "state": "active"}
+            for i in range(2)
+        ])
+        # La segunda fila no cabe en la línea: se informa y la primera se guarda
+        self.assertEqual(summary["created"], 2)
+        self.assertEqual([row for row, _msg in summary["errors"]], [2])
+        bonds = self.Bond.search([("reference", "like", "IMP-CL-")], order="reference")
+        self.assertEqual(bonds.mapped("state"), ["active", "draft"])
+        self.assertEqual(line.utilized_amount, 600.0)
+
+        # Subir el importe de un aval vigente por encima de la línea: error de esa fila
+        summary = self.Bond.import_bonds([
+            {"reference": "IMP-CL-0", "amount": 1200},
+            {"reference": "IMP-CL-1", "amount": 300, "description": "Ampliado"},
+        ])
+        self.assertEqual([row for row, _msg in summary["errors"]], [1])
+        self.assertEqual(summary["updated"], 1)
+        self.assertEqual(bonds.mapped("amount"), [600.0, 300.0])
+        self.assertEqual(line.utilized_amount, 600.0)
@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
+import base64
+from datetime import timedelta
+from unittest.mock import patch
 
+from odoo import fields
+from odoo.exceptions import UserError
 from odoo.tests.common import SavepointCase
 
+from odoo.addons.sid_bankbonds_mod.controllers.export import _iter_export_pages
+from odoo.addons.sid_bankbonds_mod.models import res_users
+
 
 class TestBondsOrder(SavepointCase):
     @classmethod
@@ -32,3 +40,334 @@ class TestBondsOrder(SavepointCase):
         bond = self.Bond.create({})
         bond.write({"reference": "REF-12345"})
         self.assertEqual(bond.name, "REF-12345")
+
+    def test_create_reserves_sequence_names_in_batch(self):
+        bonds = self.Bond.create([{} for _i in range(3)] + [{"name": "MANUAL-1"}])
+        names = bonds.mapped("name")
+        self.assertEqual(names[3], "MANUAL-1")
+        self.assertEqual(len(set(names[:3])), 3)
+        self.assertTrue(all(name.startswith("AV-") for name in names[:3]))
+        numbers = [int(name.rsplit("-", 1)[1]) for name in names[:3]]
+        self.assertEqual(numbers, sorted(numbers))
+
+    def test_base_pedidos_variation_queues_note_and_digest(self):
+        bond = self.Bond.create({"reference": "BOND-VAR-001"})
+        Variation = self.env["sid_bonds_variation"]
+        messages_before = len(bond.message_ids)
+
+        bond.write({"base_pedidos": 1000.0})
+        variation = Variation.search([("bond_id", "=", bond.id)])
+        self.assertEqual(len(variation), 1)
+        self.assertEqual(variation.state, "pending")
+        self.assertEqual(len(bond.message_ids), messages_before + 1)
+
+        # Por debajo del umbral (3%): sin nueva variación
+        bond.write({"base_pedidos": 1010.0})
+        self.assertEqual(Variation.search_count([("bond_id", "=", bond.id)]), 1)
+
+        Variation._cron_send_digest()
+        self.assertEqual(variation.state, "sent")
+
+    def test_variation_digest_single_message_for_all_managers(self):
+        manager_group = self.env.ref("sid_bankbonds_mod.group_bonds_manager")
+        managers = self.env["res.users"].create([
+            {"name": "Gestor Resumen %s" % i, "login": "gestor_resumen_%s" % i,
+             "groups_id": [(6, 0, [self.env.ref("base.group_user").id, manager_group.id])]}
+            for i in range(2)
+        ])
+        self.Bond.create([{"reference": "BOND-DIG-%s" % i} for i in range(2)]).write({"base_pedidos": 500.0})
+        subject = "Avales: variaciones en Base Imponible Pedidos"
+        messages_before = self.env["mail.message"].search([("subject", "=", subject)])
+
+        self.env["sid_bonds_variation"]._cron_send_digest()
+        digest = self.env["mail.message"].search([("subject", "=", subject)]) - messages_before
+        self.assertEqual(len(digest), 1)
+        self.assertLessEqual(managers.partner_id, digest.partner_ids)
+
+    def test_write_snapshots_base_pedidos_only_for_trigger_fields(self):
+        bond = self.Bond.create({"reference": "BOND-SNAP-001"})
+        BondClass = type(self.Bond)
+        with patch.object(BondClass, "_read_stored_base_pedidos", autospec=True,
+                          side_effect=BondClass._read_stored_base_pedidos) as read_stored:
+            bond.write({"reviewed": True, "description": "Sin cambio de base"})
+            read_stored.assert_not_called()
+
+            bond.write({"base_pedidos": 1000.0})
+            read_stored.assert_called()
+        self.assertEqual(
+            self.env["sid_bonds_variation"].search_count([("bond_id", "=", bond.id)]), 1)
+
+    def test_creator_todos_are_not_duplicated(self):
+        bonds = self.Bond.create([{"reference": "BOND-TODO-%s" % i} for i in range(3)])
+        variations = {bond.id: (0.0, 100.0, 100.0) for bond in bonds}
+        summary = "Revisar necesidad de ampliar aval"
+        domain = [
+            ("res_model", "=", self.Bond._name),
+            ("res_id", "in", bonds.ids),
+            ("summary", "=", summary),
+        ]
+
+        bonds._schedule_creator_todos(variations)
+        self.assertEqual(self.env["mail.activity"].search_count(domain), 3)
+
+        bonds._schedule_creator_todos(variations)
+        self.assertEqual(self.env["mail.activity"].search_count(domain), 3)
+
+    def test_manager_caches_follow_managers_only(self):
+        company = self.env["res.partner"].create({"name": "Empresa Gestora", "is_company": True})
+        manager_group = self.env.ref("sid_bankbonds_mod.group_bonds_manager")
+        manager = self.env["res.users"].create({
+            "name": "Gestor Menciones", "login": "gestor_menciones",
+            "groups_id": [(6, 0, [self.env.ref("base.group_user").id, manager_group.id])],
+        })
+        manager.partner_id.parent_id = company
+        self.assertIn("Empresa Gestora, Gestor Menciones", self.Bond._get_bonds_manager_mentions_html())
+
+        # Renombrar la empresa del gestor cambia su display_name en las menciones
+        company.name = "Empresa Renombrada"
+        self.assertIn("Empresa Renombrada, Gestor Menciones", self.Bond._get_bonds_manager_mentions_html())
+
+        # Usuarios que no son gestores no vacían las cachés
+        with patch.object(res_users, "_clear_bonds_manager_caches") as clear_manager_caches:
+            user = self.env["res.users"].create({"name": "Vendedor", "login": "vendedor_menciones"})
+            user.write({"active": False})
+            user.unlink()
+        clear_manager_caches.assert_not_called()
+
+        with patch.object(res_users, "_clear_bonds_manager_caches") as clear_manager_caches:
+            manager.unlink()
+        clear_manager_caches.assert_called()
+
+    def test_manager_cache_clear_keeps_other_entries(self):
+        model_id = self.env["ir.model"]._get_id("res.partner")
+        self.Bond._get_bonds_manager_partner_ids()
+        cache = self.env.registry._Registry__cache
+
+        def _cached_methods(model_name):
+            return {getattr(key[1], "__name__", None) for key in list(cache) if key[0] == model_name}
+
+        self.assertIn("_get_bonds_manager_partner_ids", _cached_methods("sid_bonds_orders"))
+        res_users._clear_bonds_manager_caches(self.env)
+        self.assertFalse(set(res_users._BONDS_MANAGER_CACHED_METHODS) & _cached_methods("sid_bonds_orders"))
+        # El resto de la caché del registry sigue ahí
+        self.assertIn("_get_id", _cached_methods("ir.model"))
+        self.assertEqual(self.env["ir.model"]._get_id("res.partner"), model_id)
+
+    def test_state_transitions_batch(self):
+        bonds = self.Bond.create([
+            {"reference": "BOND-TR-%s" % i, "amount": 1000.0} for i in range(3)
+        ])
+        bonds.action_request()
+        self.assertEqual(set(bonds.mapped("state")), {"requested"})
+
+        bonds.action_activate()
+        self.assertEqual(set(bonds.mapped("state_manage")), {"current"})
+
+        # Un solo error con todos los avales que no cumplen
+        draft = self.Bond.create([{"reference": "BOND-TR-D%s" % i} for i in range(2)])
+        with self.assertRaises(UserError) as err:
+            (bonds | draft).action_expire()
+        for bond in draft:
+            self.assertIn(bond.display_name, str(err.exception))
+        self.assertEqual(set(bonds.mapped("state")), {"active"})
+
+        with self.assertRaises(UserError):
+            draft.action_activate()  # importe 0
+
+        (bonds | draft).action_cancel()
+        self.assertEqual(set((bonds | draft).mapped("state")), {"cancelled"})
+
+    def test_cron_expires_due_bonds_and_reminds_once(self):
+        today = fields.Date.context_today(self.Bond)
+        overdue = self.Bond.create({"reference": "BOND-EXP-1", "amount": 10.0,
+                                    "due_date": today - timedelta(days=1)})
+        upcoming = self.Bond.create({"reference": "BOND-EXP-2", "amount": 10.0,
+                                     "due_date": today + timedelta(days=5)})
+        (overdue | upcoming).action_activate()
+
+        self.Bond._cron_expire_due_bonds()
+        self.assertEqual(overdue.state, "expired")
+        self.assertEqual(upcoming.state, "active")
+        self.assertTrue(upcoming.expiry_reminder_sent)
+
+        domain = [("res_model", "=", self.Bond._name), ("res_id", "=", upcoming.id),
+                  ("summary", "=", "Aval próximo a vencer")]
+        self.assertEqual(self.env["mail.activity"].search_count(domain), 1)
+        self.Bond._cron_expire_due_bonds()
+        self.assertEqual(self.env["mail.activity"].search_count(domain), 1)
+
+        upcoming.write({"due_date": today + timedelta(days=10)})
+        self.assertFalse(upcoming.expiry_reminder_sent)
+
+    def _ensure_avales_folder(self):
+        if not self.env.ref("sid_bankbonds_mod.folder_avales", raise_if_not_found=False):
+            folder = self.env["documents.folder"].create({"name": "AVALES"})
+            self.env["ir.model.data"].create({
+                "module": "sid_bankbonds_mod", "name": "folder_avales",
+                "model": folder._name, "res_id": folder.id,
+            })
+            self.env.registry.clear_caches()
+
+    def test_pdf_document_shares_field_attachment(self):
+        self._ensure_avales_folder()
+
+        pdf = base64.b64encode(b"%PDF-1.4 aval")
+        bond = self.Bond.create({"reference": "BOND-PDF-001", "pdf_aval": pdf})
+        attachment = self.env["ir.attachment"].search([
+            ("res_model", "=", bond._name), ("res_field", "=", "pdf_aval"), ("res_id", "=", bond.id),
+        ])
+        document = self.env["documents.document"].search([
+            ("res_model", "=", bond._name), ("res_id", "=", bond.id),
+        ])
+        self.assertEqual(len(document), 1)
+        self.assertEqual(document.attachment_id, attachment)
+
+        # Renombrar: mismo adjunto/checksum, solo cambia el nombre del documento
+        checksum = attachment.checksum
+        bond.write({"reference": "BOND-PDF-002"})
+        self.assertEqual(document.attachment_id, attachment)
+        self.assertEqual(attachment.checksum, checksum)
+        self.assertEqual(document.name, "BOND-PDF-002")
+
+        # Vaciar el PDF o borrar el aval no borra el documento (pasa a una copia propia)
+        bond.write({"pdf_aval": False})
+        self.assertTrue(document.exists())
+        self.assertNotEqual(document.attachment_id, attachment)
+        self.assertEqual(document.attachment_id.checksum, checksum)
+
+        other = self.Bond.create({"reference": "BOND-PDF-003", "pdf_aval": pdf})
+        other_document = self.env["documents.document"].search([
+            ("res_model", "=", other._name), ("res_id", "=", other.id),
+        ])
+        other.unlink()
+        self.assertTrue(other_document.exists())
+        self.assertEqual(other_document.attachment_id.checksum, checksum)
+
+    def test_pdf_documents_synced_for_manager_without_documents_rights(self):
+        self._ensure_avales_folder()
+        manager = self.env["res.users"].create({
+            "name": "Gestor sin Documents", "login": "gestor_sin_documents",
+            "groups_id": [(6, 0, [self.env.ref("base.group_user").id,
+                                  self.env.ref("sid_bankbonds_mod.group_bonds_manager").id])],
+        })
+        self.assertFalse(manager.has_group("documents.group_documents_user"))
+        Bond = self.Bond.with_user(manager)
+        pdf = base64.b64encode(b"%PDF-1.4 gestor")
+        bond = Bond.create({"reference": "BOND-PDF-MGR-1", "pdf_aval": pdf})
+        bond.write({"reference": "BOND-PDF-MGR-2"})
+        document = self.env["documents.document"].search([
+            ("res_model", "=", self.Bond._name), ("res_id", "=", bond.id),
+        ])
+        self.assertEqual(document.name, "BOND-PDF-MGR-2")
+
+        bond.write({"pdf_aval": False})
+        self.assertTrue(document.exists())
+
+    def test_pdf_documents_synced_in_one_batch(self):
+        self._ensure_avales_folder()
+        bonds = self.Bond.create([{"reference": "BOND-PDFB-%s" % i} for i in range(3)])
+        DocumentClass = type(self.env["documents.document"])
+        with patch.object(DocumentClass, "create", autospec=True,
+                          side_effect=DocumentClass.create) as create_documents:
+            bonds.write({"pdf_aval": base64.b64encode(b"%PDF-1.4 lote")})
+        # Un único create() con los tres documentos, no uno por aval
+        self.assertEqual(create_documents.call_count, 1)
+        self.assertEqual(len(create_documents.call_args[0][1]), 3)
+
+        documents = self.env["documents.document"].search([
+            ("res_model", "=", self.Bond._name), ("res_id", "in", bonds.ids),
+        ])
+        self.assertEqual(sorted(documents.mapped("res_id")), sorted(bonds.ids))
+        attachments = self.env["ir.attachment"].search([
+            ("res_model", "=", self.Bond._name), ("res_field", "=", "pdf_aval"), ("res_id", "in", bonds.ids),
+        ])
+        self.assertEqual(documents.attachment_id, attachments)
+
+    def test_exposure_report_refresh(self):
+        partner = self.env["res.partner"].create({"name": "Cliente Exposición"})
+        self.Bond.create([
+            {"reference": "BOND-EXPO-%s" % i, "partner_id": partner.id, "amount": 100.0, "state": "active"}
+            for i in range(2)
+        ])
+        Report = self.env["sid_bonds_exposure_report"]
+        Report._refresh()
+        line = Report.search([("partner_id", "=", partner.id)])
+        self.assertEqual(len(line), 1)
+        self.assertEqual((line.amount, line.bond_count, line.active_count), (200.0, 2, 2))
+
+    def test_exposure_report_split_by_company(self):
+        partner = self.env["res.partner"].create({"name": "Cliente Exposición Multi"})
+        other_company = self.env["res.company"].create({"name": "Otra compañía avales"})
+        journal = self.env["account.journal"].create({"name": "Banco Expo", "type": "bank", "code": "BEXP"})
+        other_journal = self.env["account.journal"].with_company(other_company).create({
+            "name": "Banco Expo 2", "type": "bank", "code": "BEX2", "company_id": other_company.id,
+        })
+        self.Bond.create([
+            {"reference": "BOND-EXPC-1", "partner_id": partner.id, "journal_id": journal.id, "amount": 100.0},
+            {"reference": "BOND-EXPC-2", "partner_id": partner.id, "journal_id": other_journal.id, "amount": 50.0},
+        ])
+        Report = self.env["sid_bonds_exposure_report"]
+        Report._refresh()
+        user = self.env["res.users"].create({
+            "name": "Gestor Expo", "login": "gestor_expo",
+            "company_id": self.env.company.id, "company_ids": [(6, 0, self.env.company.ids)],
+            "groups_id": [(6, 0, [self.env.ref("base.group_user").id,
+                                  self.env.ref("sid_bankbonds_mod.group_bonds_manager").id])],
+        })
+        lines = Report.with_user(user).search([("partner_id", "=", partner.id)])
+        self.assertEqual(lines.company_id, self.env.company)
+        self.assertEqual(lines.amount, 100.0)
+
+    def test_credit_line_utilization_and_limit(self):
+        journal = self.env["account.journal"].create({"name": "Banco Línea", "type": "bank", "code": "BLIN"})
+        currency = self.env.company.currency_id
+        line = self.env["sid_bonds_credit_line"].create({
+            "journal_id": journal.id, "currency_id": currency.id, "limit_amount": 1000.0,
+        })
+        first, second = self.Bond.create([
+            {"reference": "BOND-LINE-%s" % i, "journal_id": journal.id,
+             "currency_id": currency.id, "amount": 600.0}
+            for i in range(2)
+        ])
+        first.action_activate()
+        self.assertEqual(line.utilized_amount, 600.0)
+        with self.assertRaises(UserError):
+            second.action_activate()
+
+        first.write({"amount": 400.0})
+        self.assertEqual(line.utilized_amount, 400.0)
+        second.action_activate()
+        self.assertEqual(line.utilized_amount, 1000.0)
+
+        first.action_cancel()
+        self.assertEqual(line.utilized_amount, 600.0)
+        line.action_recompute_utilization()
+        self.assertEqual(line.utilized_amount, 600.0)
+
+    def test_export_pages(self):
+        bonds = self.Bond.create([{"reference": "BOND-EXP-%s" % i, "amount": 10.0 * i} for i in range(5)])
+        pages = list(_iter_export_pages(self.env, [("reference", "like", "BOND-EXP-")], page_size=2))
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([row[0] for page in pages for row in page], bonds.ids)
+
+    def test_export_stream_keeps_selection_server_side(self):
+        bonds = self.Bond.create([{"reference": "BOND-EXPS-%s" % i} for i in range(3)])
+        action = bonds.action_export_stream("csv")
+        self.assertNotIn("domain", action["url"])
+        export_id = int(action["url"].rsplit("export_id=", 1)[1])
+        export_request = self.env["sid_bonds_export_request"].browse(export_id)
+        self.assertEqual(export_request._get_domain(), [["id", "in", bonds.ids]])
+
+        # El cliente web envía active_domain también con una selección parcial
+        active_domain = [("reference", "like", "BOND-EXPS-")]
+        action = bonds[:2].with_context(active_domain=active_domain).action_export_stream("csv")
+        export_id = int(action["url"].rsplit("export_id=", 1)[1])
+        export_request = self.env["sid_bonds_export_request"].browse(export_id)
+        self.assertEqual(export_request._get_domain(), [["id", "in", bonds[:2].ids]])
+
+        # "Seleccionar todo": active_ids recortado al límite, se exporta el dominio de la lista
+        self.env["ir.config_parameter"].sudo().set_param("web.active_ids_limit", 1)
+        action = bonds[:1].with_context(active_domain=active_domain).action_export_stream("xlsx")
+        export_id = int(action["url"].rsplit("export_id=", 1)[1])
+        export_request = self.env["sid_bonds_export_request"].browse(export_id)
+        self.assertEqual(export_request._get_domain(), [["reference", "like", "BOND-EXPS-"]])
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import MagicMock, patch
+
+from psycopg2.extensions import TransactionRollbackError
+
+from odoo.tests.common import BaseCase, SavepointCase
+
+from odoo.addons.sid_bankbonds_mod.cli import migrate_studio
+from odoo.addons.sid_bankbonds_mod import hooks
+from odoo.addons.sid_bankbonds_mod.hooks import _relink_legacy_records
+
+
+class TestMigrateStudioPartitions(BaseCase):
+
+    def test_partitions_cover_id_range(self):
+        partitions = migrate_studio._compute_partitions("db", 1, 45, 20, 500)
+        self.assertEqual(partitions, [("db", 0, 20, 500), ("db", 20, 40, 500), ("db", 40, 45, 500)])
+        self.assertEqual(migrate_studio._compute_partitions("db", 7, 7, 20, 500), [("db", 6, 7, 500)])
+        self.assertEqual(migrate_studio._compute_partitions("db", None, None, 20, 500), [])
+
+    def test_partition_retried_after_concurrent_update(self):
+        calls = []
+
+        def _migrate(env, id_from, id_to, **kwargs):
+            calls.append(kwargs["checkpoint_key"])
+            if len(calls) < 3:
+                raise TransactionRollbackError()
+            return 12
+
+        with patch.object(migrate_studio.odoo, "registry", return_value=MagicMock()), \
+                patch.object(migrate_studio.api, "Environment"), \
+                patch.object(migrate_studio, "_migrate_studio_range", side_effect=_migrate), \
+                patch.object(migrate_studio.time, "sleep") as sleep:
+            result = migrate_studio._run_partition(("db", 0, 20, 500))
+
+        self.assertEqual(result, (0, 20, 12))
+        # Mismo punto de control en cada intento: continúa donde se quedó
+        self.assertEqual(len(set(calls)), 1)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_partition_gives_up_after_retries(self):
+        with patch.object(migrate_studio.odoo, "registry", return_value=MagicMock()), \
+                patch.object(migrate_studio.api, "Environment"), \
+                patch.object(migrate_studio, "_migrate_studio_range", side_effect=TransactionRollbackError()), \
+                patch.object(migrate_studio.time, "sleep"):
+            with self.assertRaises(TransactionRollbackError):
+                migrate_studio._run_partition(("db", 0, 20, 500))
+
+
+class TestRelinkLegacyRecords(SavepointCase):
+    """Re-enlace SQL de x_bonds.orders sin Studio: filas con model/res_model legacy a mano."""
+
+    LEGACY_ID = 987001
+
+    def _to_legacy(self, table, model_column, ids):
+        self.env["base"].flush()
+        self.env.cr.execute(
+            "UPDATE %s SET %s = 'x_bonds.orders', res_id = %%s WHERE id IN %%s" % (table, model_column),
+            (self.LEGACY_ID, tuple(ids)),
+        )
+        self.env["base"].invalidate_cache()
+
+    def test_relink_legacy_records(self):
+        Bond = self.env["sid_bonds_orders"]
+        bond = Bond.create({"reference": "BOND-RELINK"})
+        placeholder = Bond.create({"reference": "BOND-RELINK-TMP"})
+        moved, already = self.env["res.partner"].create([
+            {"name": "Seguidor legacy"}, {"name": "Seguidor ya presente"},
+        ])
+        bond.message_subscribe(partner_ids=already.ids)
+
+        message = placeholder.message_post(body="Nota legacy")
+        placeholder.message_subscribe(partner_ids=(moved | already).ids)
+        followers = self.env["mail.followers"].search([
+            ("res_model", "=", Bond._name), ("res_id", "=", placeholder.id),
+            ("partner_id", "in", (moved | already).ids),
+        ])
+        activity = placeholder.activity_schedule("mail.mail_activity_data_todo", summary="Legacy")
+        self._to_legacy("mail_message", "model", message.ids)
+        self._to_legacy("mail_followers", "res_model", followers.ids)
+        self._to_legacy("mail_activity", "res_model", activity.ids)
+
+        Attachment = self.env["ir.attachment"]
+        pdf, other = Attachment.create([
+            {"name": "aval.pdf", "raw": b"%PDF-1.4 legacy", "res_model": "x_bonds.orders",
+             "res_id": self.LEGACY_ID, "res_field": "x_aval"},
+            {"name": "anexo.txt", "raw": b"anexo", "res_model": "x_bonds.orders",
+             "res_id": self.LEGACY_ID},
+        ])
+
+        _relink_legacy_records(self.env, {self.LEGACY_ID: bond.id})
+
+        self.assertEqual((message.model, message.res_id), (Bond._name, bond.id))
+        self.assertEqual((activity.res_model, activity.res_id), (Bond._name, bond.id))
+        self.assertEqual(activity.res_model_id, self.env["ir.model"]._get(Bond._name))
+        self.assertEqual((pdf.res_model, pdf.res_id, pdf.res_field), (Bond._name, bond.id, "pdf_aval"))
+        self.assertEqual((other.res_model, other.res_id, other.res_field), (Bond._name, bond.id, False))
+
+        # El seguidor nuevo pasa al aval; el que ya seguía al aval se queda en el legacy
+        moved_follower = followers.filtered(lambda f: f.partner_id == moved)
+        kept_follower = followers.filtered(lambda f: f.partner_id == already)
+        self.assertEqual((moved_follower.res_model, moved_follower.res_id), (Bond._name, bond.id))
+        self.assertEqual((kept_follower.res_model, kept_follower.res_id), ("x_bonds.orders", self.LEGACY_ID))
+        self.assertEqual(
+            self.env["mail.followers"].search_count([
+                ("res_model", "=", Bond._name), ("res_id", "=", bond.id), ("partner_id", "=", already.id),
+            ]), 1)
+
+
+class TestStudioMigrationChunks(SavepointCase):
+    """Lotes, punto de control y referencias duplicadas sin Studio (x_bonds_orders simulada)."""
+
+    LEGACY_IDS = list(range(101, 108))
+    CHECKPOINT = "sid_bankbonds_mod.test_studio_checkpoint"
+
+    def _fake_fetch(self, env, after_id, until_id, limit):
+        ids = [i for i in self.LEGACY_IDS if i > after_id and (until_id is None or i <= until_id)]
+        return [(legacy_id, 10.0, None, None) for legacy_id in ids[:limit]]
+
+    def _run(self, **kwargs):
+        chunks = []
+        checkpoints = []
+
+        def _fake_migrate(env, rows):
+            chunks.append([row[0] for row in rows])
+            checkpoints.append(hooks._get_migration_checkpoint(env, self.CHECKPOINT))
+            return len(rows)
+
+        with patch.object(hooks, "_fetch_legacy_chunk", side_effect=self._fake_fetch), \
+                patch.object(hooks, "_migrate_legacy_chunk", side_effect=_fake_migrate), \
+                patch.object(self.env.cr, "commit") as commit:
+            processed = hooks._migrate_studio_range(
+                self.env, chunk_size=3, checkpoint_key=self.CHECKPOINT, **kwargs)
+        return processed, chunks, checkpoints, commit
+
+    def test_chunks_in_one_transaction_without_checkpoint(self):
+        processed, chunks, checkpoints, commit = self._run()
+        self.assertEqual(processed, 7)
+        self.assertEqual(chunks, [[101, 102, 103], [104, 105, 106], [107]])
+        self.assertEqual(checkpoints, [0, 0, 0])
+        commit.assert_not_called()
+
+    def test_resume_from_checkpoint(self):
+        hooks._set_migration_checkpoint(self.env, self.CHECKPOINT, 103)
+        processed, chunks, checkpoints, commit = self._run(commit=True)
+        # Lo ya migrado (<= 103) no se repite; el punto de control avanza por lote
+        self.assertEqual(processed, 4)
+        self.assertEqual(chunks, [[104, 105, 106], [107]])
+        self.assertEqual(checkpoints, [103, 106])
+        self.assertEqual(commit.call_count, 3)
+        # Al terminar se borra: la siguiente ejecución revisa todo el rango
+        self.assertEqual(hooks._get_migration_checkpoint(self.env, self.CHECKPOINT), 0)
+
+    def test_range_bounds(self):
+        processed, chunks, _checkpoints, _commit = self._run(id_from=102, id_to=105)
+        self.assertEqual(processed, 3)
+        self.assertEqual(chunks, [[103, 104, 105]])
+
+    def test_duplicated_references_migrated_without_reference(self):
+        self.env["sid_bonds_orders"].create({"reference": "LEGACY-USED"})
+        free_reference = hooks._legacy_reference_allocator(self.env, {"LEGACY-USED", "LEGACY-NEW"})
+        self.assertFalse(free_reference("LEGACY-USED", 1))
+        self.assertEqual(free_reference("LEGACY-NEW", 2), "LEGACY-NEW")
+        # Repetida dentro del mismo lote de Studio
+        self.assertFalse(free_reference("LEGACY-NEW", 3))
+        self.assertFalse(free_reference(False, 4))
+
+
+class TestMigrateStudioCheckpoints(SavepointCase):
+
+    def test_stale_partition_checkpoints_removed(self):
+        stale = migrate_studio._partition_checkpoint_key(0, 20000)
+        hooks._set_migration_checkpoint(self.env, stale, 15000)
+        hooks._set_migration_checkpoint(self.env, "sid_bankbonds_mod.other_setting", 1)
+        migrate_studio._clear_partition_checkpoints(self.env)
+        self.assertEqual(hooks._get_migration_checkpoint(self.env, stale), 0)
+        self.assertEqual(hooks._get_migration_checkpoint(self.env, "sid_bankbonds_mod.other_setting"), 1)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from odoo.exceptions import ValidationError
+from odoo.tests.common import SavepointCase
+
+
+class TestQuotationFamily(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Quotation = cls.env["sale.quotations"]
+        cls.partner = cls.env["res.partner"].create({"name": "Cliente Familia", "is_company": True})
+        cls.other_partner = cls.env["res.partner"].create({"name": "Otro Familia", "is_company": True})
+        cls.product = cls.env["product.product"].create({"name": "Producto familia", "type": "service"})
+        cls.root = cls.Quotation.create({"name": "CTR-FAM-ROOT"})
+        cls.child = cls.Quotation.create({"name": "CTR-FAM-CHILD", "parent_id": cls.root.id})
+
+    def _confirmed_order(self, partner, contract, price=100.0, date_order=None):
+        order = self.env["sale.order"].create({
+            "partner_id": partner.id,
+            "quotations_id": contract.id,
+            "order_line": [(0, 0, {
+                "product_id": self.product.id,
+                "product_uom_qty": 1,
+                "price_unit": price,
+                "tax_id": [(6, 0, [])],
+            })],
+        })
+        order.action_confirm()
+        if date_order:
+            order.write({"date_order": date_order})
+        return order
+
+    def test_child_order_in_root_family_and_counters(self):
+        root_order = self._confirmed_order(self.partner, self.root)
+        child_order = self._confirmed_order(self.partner, self.child)
+        self._confirmed_order(self.partner, self.child).action_cancel()
+        self.env["sid_bonds_orders"].create({
+            "reference": "BOND-FAM-1", "contract_ids": [(6, 0, self.root.ids)],
+        })
+
+        self.assertEqual(self.root.sale_order_sale_ids, root_order | child_order)
+        self.assertEqual(self.child.sale_order_sale_ids, root_order | child_order)
+        # Solo el principal guarda la familia; la adenda la lee a través de él
+        self.assertEqual(self.root.family_order_ids, root_order | child_order)
+        self.assertFalse(self.child.family_order_ids)
+        self.assertEqual(self.child.sale_order_count, 2)
+        self.assertEqual(self.root.child_count, 1)
+        self.assertEqual(self.root.sale_order_count, 2)
+        self.assertEqual(self.root.bond_count, 1)
+        self.assertEqual(self.child.bond_count, 0)
+
+    def test_search_family_orders_from_addendum(self):
+        child_order = self._confirmed_order(self.partner, self.child)
+        other = self.Quotation.create({"name": "CTR-FAM-UNRELATED"})
+        contracts = self.root | self.child | other
+        found = self.Quotation.search([
+            ("id", "in", contracts.ids), ("sale_order_sale_ids", "in", child_order.ids),
+        ])
+        self.assertEqual(found, self.root | self.child)
+        found = self.Quotation.search([
+            ("id", "in", contracts.ids), ("sale_order_sale_ids", "not in", child_order.ids),
+        ])
+        self.assertEqual(found, other)
+
+    def test_search_family_orders_set_from_addendum(self):
+        self._confirmed_order(self.partner, self.child)
+        other = self.Quotation.create({"name": "CTR-FAM-EMPTY"})
+        contracts = self.root | self.child | other
+        found = self.Quotation.search([("id", "in", contracts.ids), ("sale_order_sale_ids", "!=", False)])
+        self.assertEqual(found, self.root | self.child)
+        found = self.Quotation.search([("id", "in", contracts.ids), ("sale_order_sale_ids", "=", False)])
+        self.assertEqual(found, other)
+
+    def test_latest_confirmed_order_sets_partner(self):
+        contract = self.Quotation.create({"name": "CTR-FAM-SOLO"})
+        self._confirmed_order(self.other_partner, contract, date_order="2024-02-01 10:00:00")
+        self._confirmed_order(self.partner, contract, date_order="2024-01-01 10:00:00")
+        self.assertEqual(contract.partner_id, self.other_partner)
+
+        # Misma fecha: desempata el id más alto
+        late = self._confirmed_order(self.partner, contract, date_order="2024-02-01 10:00:00")
+        self.assertEqual(contract.partner_id, late.partner_id)
+        self.assertEqual(contract._get_effective_partner_from_sale_orders(), self.partner)
+
+    def test_child_with_other_partner_rejected(self):
+        self._confirmed_order(self.partner, self.root)
+        addendum = self.Quotation.create({"name": "CTR-FAM-OTHER"})
+        self._confirmed_order(self.other_partner, addendum)
+        with self.assertRaises(ValidationError):
+            addendum.write({"parent_id": self.root.id})
+
+    def test_family_aggregates_follow_bonds(self):
+        self._confirmed_order(self.partner, self.child, price=400.0)
+        bond = self.env["sid_bonds_orders"].create({
+            "reference": "BOND-FAM-AGG",
+            "amount": 100.0,
+            "currency_id": self.root._get_family_aggregate_company().currency_id.id,
+            "contract_ids": [(6, 0, self.child.ids)],
+        })
+        self.assertAlmostEqual(self.root.family_confirmed_untaxed, 400.0)
+        self.assertAlmostEqual(self.root.family_bond_amount, 100.0)
+        self.assertEqual(self.root.family_open_bond_count, 1)
+        self.assertAlmostEqual(self.root.family_coverage_ratio, 25.0)
+
+        bond.write({"amount": 200.0})
+        self.assertAlmostEqual(self.root.family_bond_amount, 200.0)
+        self.assertAlmostEqual(self.root.family_coverage_ratio, 50.0)
+
+        bond.action_cancel()
+        self.assertEqual(self.root.family_open_bond_count, 0)
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+
+from . import bonds_import_wizard
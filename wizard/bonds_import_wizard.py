@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import base64
+import csv
+import io
+import json
+
+from odoo import _, fields, models
+from odoo.exceptions import UserError
+
+
+class BondsImportWizard(models.TransientModel):
+    """Asistente de importación masiva de avales (CSV/JSON) por referencia."""
+    _name = "sid_bonds_import_wizard"
+    _description = "Importar avales"
+
+    file = fields.Binary(string="Fichero", required=True)
+    filename = fields.Char(string="Nombre del fichero")
+    file_type = fields.Selection(
+        [("csv", "CSV"), ("json", "JSON")],
+        string="Formato",
+        default="csv",
+        required=True,
+    )
+    delimiter = fields.Char(string="Separador", default=",", size=1)
+    state = fields.Selection([("draft", "Borrador"), ("done", "Hecho")], default="draft")
+    result = fields.Text(string="Resultado", readonly=True)
+
+    def _read_rows(self):
+        self.ensure_one()
+        content = base64.b64decode(self.file or b"")
+        text = content.decode("utf-8-sig")
+        file_type = self.file_type
+        if self.filename and self.filename.lower().endswith(".json"):
+            file_type = "json"
+        if file_type == "json":
+            try:
+                rows = json.loads(text)
+            except ValueError as e:
+                raise UserError(_("El fichero JSON no es válido: %s") % e)
+            if isinstance(rows, dict):
+                rows = [rows]
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise UserError(_("El JSON debe ser una lista de objetos (uno por aval)."))
+            return rows
+        return list(csv.DictReader(io.StringIO(text), delimiter=self.delimiter or ","))
+
+    def action_import(self):
+        self.ensure_one()
+        summary = self.env["sid_bonds_orders"].import_bonds(self._read_rows())
+        lines = [
+            _("Creados: %s") % summary["created"],
+            _("Actualizados: %s") % summary["updated"],
+            _("Sin cambios: %s") % summary["unchanged"],
+        ]
+        if summary["errors"]:
+            lines.append(_("Errores (%s):") % len(summary["errors"]))
+            lines += [_("Fila %s: %s") % (line, message) for line, message in summary["errors"]]
+        self.write({"state": "done", "result": "\n".join(lines)})
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }